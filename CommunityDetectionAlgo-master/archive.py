@@ -0,0 +1,161 @@
+"""Columnar archive of tweet dumps, so global counts can be rebuilt without parsing JSON again.
+
+Every dump is converted to one Parquet file in the archive directory, holding the id, created_at and text of its
+statuses in zstd compressed row groups, each sorted by created_at. Parquet keeps the min and max created_at of every
+row group, so reading a window only decodes the row groups that overlap it. Statuses repeated within a dump are
+archived once. Repeats across dumps are archived as often as they occur, unless convert is given filters of the ids
+archived so far, and are skipped when counted with the 'seen' filters of Process.
+"""
+import hashlib
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from collections import Counter
+from datetime import datetime
+from typing import List, Dict, Optional, Generator
+from bloom import DailyBloomFilters
+from dump_reader import read_dump
+from text_processing import process_text
+from util import BatchCount
+
+SCHEMA = pa.schema([('id', pa.int64()), ('created_at', pa.timestamp('s')), ('text', pa.string())])
+_TIMESTAMP = SCHEMA.field('created_at').type
+
+
+def archive_path(filepath: str, archive: str) -> str:
+    """Return the path of the Parquet file of a dump in the archive directory, named after the dump and a hash of its
+    full path, so dumps with the same name in different directories don't collide.
+    """
+    digest = hashlib.blake2b(os.path.abspath(filepath).encode('utf-8'), digest_size=4).hexdigest()
+    return os.path.join(archive, f'{os.path.splitext(os.path.basename(filepath))[0]}-{digest}.parquet')
+
+
+def convert(filepath: str, archive: str, row_group_size: int = 100000, seen: DailyBloomFilters = None) -> str:
+    """Write the statuses of a dump to the archive directory and return the path of the Parquet file. Statuses
+    repeated within the dump, or already in 'seen' if given, are left out. 'seen' is meant for ids archived before,
+    and must not be the 'seen' of a Process, or the statuses it counted would never be archived. Only one row group is
+    held in memory at a time. A dump that is already archived is left as is.
+    """
+    os.makedirs(archive, exist_ok=True)
+    path = archive_path(filepath, archive)
+    if os.path.exists(path):
+        print(filepath, 'is already archived')
+        return path
+    if seen is None:
+        seen = DailyBloomFilters()
+    with pq.ParquetWriter(path + '.tmp', SCHEMA, compression='zstd') as writer:
+        columns = ([], [], [])
+        for status in read_dump(filepath):
+            if status.id is not None and not seen.add(status.id, status.created_at):
+                continue
+            columns[0].append(status.id)
+            columns[1].append(status.created_at)
+            columns[2].append(status.text)
+            if len(columns[0]) == row_group_size:
+                writer.write_table(pa.table(columns, schema=SCHEMA).sort_by('created_at'))
+                columns = ([], [], [])
+        if columns[0]:
+            writer.write_table(pa.table(columns, schema=SCHEMA).sort_by('created_at'))
+    os.replace(path + '.tmp', path)
+    # Only once the statuses are archived, a no-op for the filters of a single dump.
+    seen.save()
+    return path
+
+
+def read_window(archive: str, start: datetime = None, end: datetime = None, columns: List[str] = None) \
+        -> Generator[pa.Table, None, None]:
+    """Yield the statuses in the archive created within [start, end), one table per row group read. Row groups
+    whose created_at statistics fall outside of the window are skipped without being decoded. Without a window,
+    every status is yielded, including those without a creation time.
+    """
+    columns = columns or SCHEMA.names
+    read_columns = columns if 'created_at' in columns else columns + ['created_at']
+    for name in sorted(os.listdir(archive)):
+        if not name.endswith('.parquet'):
+            continue
+        parquet = pq.ParquetFile(os.path.join(archive, name))
+        created_at_index = parquet.schema_arrow.get_field_index('created_at')
+        for i in range(parquet.num_row_groups):
+            if start is not None or end is not None:
+                stats = parquet.metadata.row_group(i).column(created_at_index).statistics
+                if stats is None or not stats.has_min_max:
+                    # Only statuses without a creation time.
+                    continue
+                if (end is not None and stats.min >= end) or (start is not None and stats.max < start):
+                    continue
+            table = parquet.read_row_group(i, columns=read_columns)
+            if start is not None:
+                table = table.filter(pc.greater_equal(table['created_at'], pa.scalar(start, _TIMESTAMP)))
+            if end is not None:
+                table = table.filter(pc.less(table['created_at'], pa.scalar(end, _TIMESTAMP)))
+            yield table.select(columns)
+
+
+def count_row_groups(archive: str, start: datetime = None, end: datetime = None, seen: DailyBloomFilters = None) \
+        -> Generator[Dict[Optional[datetime], BatchCount], None, None]:
+    """Yield the word counts of the statuses in the archive created within [start, end) per hour bucket, one row group
+    at a time, None being the bucket of statuses without a creation time, ready for CountBuffer.add_batch. Statuses
+    in 'seen' are skipped and the others are added to it.
+    """
+    for table in read_window(archive, start, end, ['id', 'created_at', 'text']):
+        if seen is not None:
+            keep = [status_id is None or seen.add(status_id, created_at)
+                    for status_id, created_at in zip(table['id'].to_pylist(), table['created_at'].to_pylist())]
+            table = table.filter(pa.array(keep, type=pa.bool_()))
+        if table.num_rows == 0:
+            continue
+        table = table.sort_by('created_at')
+        hours = pc.floor_temporal(table['created_at'], unit='hour')
+        # Rows are sorted, so every hour is one run of rows.
+        hour_values = hours.cast(pa.int64()).fill_null(np.iinfo(np.int64).min).to_numpy()
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(hour_values)) + 1, [len(hour_values)]])
+        texts = table['text']
+        buckets = {}
+        for run_start, run_end in zip(bounds[:-1], bounds[1:]):
+            hour = hours[int(run_start)].as_py()
+            if hour not in buckets:
+                buckets[hour] = BatchCount(Counter())
+            for text in texts.slice(run_start, run_end - run_start).to_pylist():
+                buckets[hour].add_words(process_text(text))
+        yield buckets
+
+
+def count_hours(archive: str, start: datetime = None, end: datetime = None) -> Dict[Optional[datetime], BatchCount]:
+    """Return the word counts of the statuses in the archive created within [start, end) per hour bucket."""
+    buckets = {}
+    for partial in count_row_groups(archive, start, end):
+        for hour, batch in partial.items():
+            if hour not in buckets:
+                buckets[hour] = BatchCount(Counter())
+            buckets[hour].update(batch)
+    return buckets
+
+
+def count_window(archive: str, start: datetime = None, end: datetime = None) -> BatchCount:
+    """Return the word count of the statuses in the archive created within [start, end)."""
+    total = BatchCount(Counter())
+    for table in read_window(archive, start, end, ['text']):
+        for text in table['text'].to_pylist():
+            total.add_words(process_text(text))
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert tweet dumps to a Parquet archive, or count a window of it.')
+    parser.add_argument('archive')
+    parser.add_argument('filepaths', nargs='*', help='dumps to add to the archive')
+    parser.add_argument('--start', type=datetime.fromisoformat)
+    parser.add_argument('--end', type=datetime.fromisoformat)
+    parser.add_argument('--seen', help='directory of the ids archived so far, to archive statuses repeated across '
+                                       'dumps once, not the one of process.py')
+    args = parser.parse_args()
+
+    if args.filepaths:
+        seen = DailyBloomFilters(args.seen) if args.seen else None
+        for filepath in args.filepaths:
+            print(convert(filepath, args.archive, seen=seen))
+    else:
+        print(count_window(args.archive, args.start, args.end).counter.most_common(50))
@@ -0,0 +1,90 @@
+"""Compare writing label graph paths one update per node against the bulk write of add_paths_to_label_graph.
+
+Usage: python benchmarks/bench_label_graph.py [mongodb_uri] [--rtt ms]
+Without a uri the benchmark runs against mongomock, with a simulated round trip of --rtt milliseconds before every
+operation since mongomock has none. mongomock scans every document on each update, so only the smaller sizes are run.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import schema  # noqa: E402
+from database_handler import DatabaseHandler  # noqa: E402
+
+START, END = datetime(2019, 3, 1), datetime(2019, 5, 1)
+
+
+def random_paths(n_paths: int, length: int, n_users: int):
+    return [[f'user{random.randrange(n_users)}' for _ in range(length)] for _ in range(n_paths)]
+
+
+class RoundTrips:
+    """Proxy of a client, database or collection that sleeps 'rtt' seconds before every operation."""
+
+    def __init__(self, target, rtt: float) -> None:
+        self._target = target
+        self._rtt = rtt
+
+    def __getitem__(self, name: str) -> 'RoundTrips':
+        return RoundTrips(self._target[name], self._rtt)
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self._rtt)
+            return attr(*args, **kwargs)
+        return call
+
+
+def per_node_updates(db: DatabaseHandler, paths, community: str) -> None:
+    """The previous implementation, one upsert per node of every path."""
+    edges_col = db.client['productionFunction']['labelGraphEdges']
+    for path in paths:
+        for i in range(0, len(path)):
+            parent = path[i + 1] if i < len(path) - 1 else path[i]
+            edges_col.update_one({'community': community, 'ranking_type': 'production', 'start': START, 'end': END,
+                                  'node': path[i]},
+                                 {'$set': {'parent': parent}}, upsert=True)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('uri', nargs='?')
+    parser.add_argument('--rtt', type=float, default=1.0, help='simulated round trip under mongomock, in ms')
+    args = parser.parse_args()
+    if args.uri is not None:
+        import pymongo
+        client = pymongo.MongoClient(args.uri)
+        schema.ensure_indexes(client)
+        sizes = [10, 100, 1000]
+    else:
+        import mongomock
+        client = RoundTrips(mongomock.MongoClient(), args.rtt / 1000)
+        sizes = [10, 100]
+    db = DatabaseHandler(client=client)
+    for n_paths in sizes:
+        paths = random_paths(n_paths, 6, 10 * n_paths)
+
+        started = time.perf_counter()
+        per_node_updates(db, paths, f'per_node_{n_paths}')
+        per_node = time.perf_counter() - started
+
+        started = time.perf_counter()
+        db.add_paths_to_label_graph(paths, f'bulk_{n_paths}', 'production', START, END)
+        bulk = time.perf_counter() - started
+
+        print(f'{n_paths} paths: per node {per_node * 1000:.1f}ms, bulk {bulk * 1000:.1f}ms, '
+              f'speedup {per_node / bulk:.1f}x')
+    client.drop_database('productionFunction')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Compare the previous Python loop production scoring with RetweetMatrix on synthetic neighbourhoods.
+
+Usage: python benchmarks/bench_scoring.py
+"""
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scoring import RetweetMatrix  # noqa: E402
+
+
+def synthetic_retweets(n_users: int, retweets_per_user: int = 50, outside: float = 0.5):
+    local = [f'user{i}' for i in range(n_users)]
+    retweets = {}
+    for user in local:
+        retweets[user] = [('text', f'user{random.randrange(n_users)}' if random.random() > outside
+                           else f'stranger{random.randrange(10 * n_users)}')
+                          for _ in range(retweets_per_user)]
+    return local, retweets
+
+
+def loop_production_scores(local, retweets):
+    """The previous implementation, with the membership check against the list."""
+    score = OrderedDict.fromkeys(local, 0)
+    for user in local:
+        for retweet in retweets[user]:
+            if retweet[1] != user and retweet[1] in local:
+                score[retweet[1]] += 1
+    return score
+
+
+def main():
+    for n_users in [1000, 5000, 10000, 50000]:
+        local, retweets = synthetic_retweets(n_users)
+
+        started = time.perf_counter()
+        matrix = RetweetMatrix(local, retweets)
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        production = matrix.production_scores()
+        matrix.consumption_scores()
+        matrix.top(production, 20)
+        scored = time.perf_counter() - started
+        line = f'{n_users} users: matrix build {built:.3f}s, scoring {scored * 1000:.1f}ms'
+
+        # The loop is quadratic, only time it where it finishes in reasonable time.
+        if n_users <= 5000:
+            started = time.perf_counter()
+            expected = loop_production_scores(local, retweets)
+            loop = time.perf_counter() - started
+            assert list(expected.values()) == production.tolist()
+            line += f', python loop {loop:.3f}s'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Compare the Counter implementation of WordFreq's relative frequencies with the TermMatrix pipeline on synthetic
+neighbourhoods with Zipf distributed vocabularies.
+
+Usage: python benchmarks/bench_term_matrix.py [n_users ...]
+"""
+import copy
+import os
+import sys
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from term_matrix import TermMatrix  # noqa: E402
+from util import BatchCount  # noqa: E402
+
+VOCABULARY = 20000
+STOPWORDS = {f'w{i}' for i in range(20)}
+
+
+def synthetic_counts(n_users: int, words_per_user: int = 300):
+    rng = np.random.default_rng(0)
+    user_counts = OrderedDict()
+    for i in range(n_users):
+        words = rng.zipf(1.3, words_per_user)
+        user_counts[f'user{i}'] = Counter(f'w{w}' for w in words[words < VOCABULARY])
+    global_count = BatchCount(Counter({f'w{w}': int(c) for w, c in
+                                       enumerate(rng.integers(0, 1000, VOCABULARY)) if c}))
+    return user_counts, global_count
+
+
+def counter_pipeline(user_counts, global_count, n=4):
+    """The Counter implementation of processed_local_plus_global_count followed by relative_frequency."""
+    local_count = BatchCount(Counter())
+    for counter in user_counts.values():
+        local_count.update(BatchCount(counter))
+    processed_global = BatchCount(Counter(global_count.counter), global_count.total)
+    for word in STOPWORDS:
+        if word in local_count.counter:
+            local_count.remove_word(word)
+        if word in processed_global.counter:
+            processed_global.remove_word(word)
+    unprocessed = local_count + processed_global
+    processed = copy.deepcopy(unprocessed)
+    for word, count in unprocessed.counter.items():
+        if count < n:
+            processed.remove_word(word)
+    word_dist = Counter()
+    for counter in user_counts.values():
+        word_dist.update(counter.keys())
+    for word, count in word_dist.items():
+        if count < n and word in processed.counter:
+            processed.remove_word(word)
+    rel_freqs = {}
+    for user, user_count in user_counts.items():
+        rel_freq = copy.copy(processed.counter)
+        for word, count in rel_freq.items():
+            rel_freq[word] = user_count[word] / count if word in user_count else 0
+        rel_freqs[user] = rel_freq
+    return rel_freqs
+
+
+def matrix_pipeline(user_counts, global_count, n=4):
+    terms = TermMatrix.from_counts(user_counts)
+    totals = terms.totals() + terms.align(global_count.counter)
+    keep = ~terms.mask(STOPWORDS) & (totals >= n) & (terms.document_frequency() >= n)
+    return terms.select(keep).divide(totals[keep])
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1000, 10000]
+    for n_users in sizes:
+        user_counts, global_count = synthetic_counts(n_users)
+
+        started = time.perf_counter()
+        rel = matrix_pipeline(user_counts, global_count)
+        matrix = time.perf_counter() - started
+
+        started = time.perf_counter()
+        expected = counter_pipeline(user_counts, global_count)
+        counters = time.perf_counter() - started
+
+        for user in rel.users[:100]:
+            row = rel.row(user)
+            assert {k for k, v in expected[user].items() if v} == set(row)
+            assert all(abs(expected[user][k] - v) < 1e-12 for k, v in row.items())
+        print(f'{n_users} users: Counter {counters:.2f}s, TermMatrix {matrix:.2f}s, speedup {counters / matrix:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
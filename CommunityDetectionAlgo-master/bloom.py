@@ -0,0 +1,137 @@
+import hashlib
+import math
+import os
+import struct
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+# capacity, error rate, number of bits, number of hashes and number of keys added.
+_HEADER = struct.Struct('<qdqqq')
+
+
+class BloomFilter:
+    """Fixed-size set of integer keys, e.g. status ids, that can answer a false positive but never a false negative.
+    Sized for 'capacity' keys at a false positive rate of 'error_rate'; past its capacity the rate goes up quickly,
+    so a warning is printed once it is full. If 'path' is given and exists, the filter is loaded from that file on
+    creation, and save writes it back there.
+    """
+
+    def __init__(self, capacity: int = 10 ** 7, error_rate: float = 0.001, path: Optional[str] = None) -> None:
+        """Creates a new, empty BloomFilter, or the one saved at 'path'."""
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.path = path
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.count = 0
+        self.bits = bytearray((self.n_bits + 7) // 8)
+        # True if keys were added since the filter was last saved or loaded.
+        self.dirty = False
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def _positions(self, key: int):
+        """Return the bit positions of a key, by double hashing one blake2b digest."""
+        digest = hashlib.blake2b(key.to_bytes(8, 'little', signed=True), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, key: int) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, key: int) -> bool:
+        """Add a key, and return True if it was not in the filter yet."""
+        bits = self.bits
+        new = False
+        for pos in self._positions(key):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+            self.dirty = True
+            if self.count == self.capacity + 1:
+                print(f'BloomFilter {self.path or "in memory"} holds more than {self.capacity} keys, new keys are '
+                      f'increasingly mistaken for seen ones')
+        return new
+
+    def load(self) -> None:
+        """Load the filter saved at 'path'."""
+        with open(self.path, 'rb') as file:
+            self.capacity, self.error_rate, self.n_bits, self.n_hashes, self.count = \
+                _HEADER.unpack(file.read(_HEADER.size))
+            self.bits = bytearray(file.read())
+        self.dirty = False
+
+    def save(self) -> None:
+        """Save the filter to 'path'."""
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(_HEADER.pack(self.capacity, self.error_rate, self.n_bits, self.n_hashes, self.count))
+            file.write(self.bits)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+class DailyBloomFilters:
+    """BloomFilters of keys split by the UTC day of their creation time, e.g. the created_at of a status, so no filter
+    has to hold more than a day of keys. Every copy of a status has the same created_at, so only the filter of that
+    day is checked. Keys without a time share one more filter.
+
+    If 'directory' is given, every day is saved there as its own file. At most 'max_open' days are kept in memory,
+    but a day with keys added since the last save is only dropped after save, so no day is saved ahead of the counts
+    it stands for.
+    """
+
+    def __init__(self, directory: Optional[str] = None, capacity: int = 10 ** 7, error_rate: float = 0.001,
+                 max_open: int = 8) -> None:
+        """Creates new DailyBloomFilters, each sized for 'capacity' keys a day."""
+        self.directory = directory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.max_open = max_open
+        self.filters = OrderedDict()
+
+    def _filter(self, created_at: Optional[datetime]) -> BloomFilter:
+        """Return the filter of the day of 'created_at', loading it if needed."""
+        day = None if created_at is None else created_at.date()
+        bloom = self.filters.get(day)
+        if bloom is not None:
+            self.filters.move_to_end(day)
+            return bloom
+        path = None
+        if self.directory is not None:
+            path = os.path.join(self.directory, ('untimed' if day is None else day.isoformat()) + '.bloom')
+        bloom = self.filters[day] = BloomFilter(self.capacity, self.error_rate, path)
+        if self.directory is not None:
+            for old_day in [old_day for old_day, old in self.filters.items() if not old.dirty and old_day != day]:
+                if len(self.filters) <= self.max_open:
+                    break
+                del self.filters[old_day]
+        return bloom
+
+    def contains(self, key: int, created_at: Optional[datetime] = None) -> bool:
+        """Return True if the key was added with a creation time on the same day."""
+        return key in self._filter(created_at)
+
+    def add(self, key: int, created_at: Optional[datetime] = None) -> bool:
+        """Add a key to the filter of the day of 'created_at', and return True if it was not in it yet."""
+        return self._filter(created_at).add(key)
+
+    def save(self) -> None:
+        """Save every day with keys added since it was last saved."""
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for bloom in self.filters.values():
+            if bloom.dirty:
+                bloom.save()
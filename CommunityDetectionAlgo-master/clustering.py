@@ -1,62 +1,190 @@
 from collections import OrderedDict, Counter
+import time
+import tracemalloc
 import numpy
-import scipy
-from sklearn.cluster import AffinityPropagation
+import scipy.sparse
+from sklearn.cluster import AffinityPropagation, SpectralClustering, MiniBatchKMeans
+from sklearn.metrics import pairwise_distances_argmin
+from sklearn.neighbors import kneighbors_graph
+from sklearn.preprocessing import normalize
 from word_freq import WordFreq
-from typing import Dict
-from sklearn.metrics.pairwise import cosine_distances
+from term_matrix import TermMatrix
+from typing import Dict, Tuple, List
+from sklearn.metrics.pairwise import cosine_distances, cosine_similarity
 
 #Counters are ordered https://stackoverflow.com/questions/52174284/how-are-counter-defaultdict-ordered-in-python-3-7
 
+class ClusterResult:
+    """Labels of a clustering, the index of the user at the center of every cluster, and what it cost."""
+
+    def __init__(self, backend: str, labels: numpy.ndarray, cluster_centers_indices: numpy.ndarray, seconds: float,
+                 peak_bytes: int) -> None:
+        self.backend = backend
+        self.labels_ = labels
+        self.cluster_centers_indices_ = cluster_centers_indices
+        self.seconds = seconds
+        self.peak_bytes = peak_bytes
+
+    def __str__(self):
+        return f'ClusterResult(backend={self.backend}, clusters={len(self.cluster_centers_indices_)}, ' \
+               f'seconds={self.seconds:.2f}, peak={self.peak_bytes / 2 ** 20:.1f}MB)'
+
+
+class AffinityBackend:
+    """Affinity propagation on the dense cosine similarity matrix. O(n^2) memory, for small neighbourhoods."""
+    name = 'affinity'
+
+    def fit(self, X) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Return the labels and the indices of the centers of the clustering of the rows of X."""
+        affprop = AffinityPropagation(affinity='precomputed').fit(cosine_similarity(X))
+        if affprop.n_iter_ >= affprop.max_iter or len(affprop.cluster_centers_indices_) == 0 \
+                or (affprop.labels_ < 0).any():
+            # Did not converge, scikit-learn labels every user -1. Every user is its own cluster instead.
+            print('Affinity propagation did not converge, every user is its own cluster')
+            return numpy.arange(X.shape[0]), numpy.arange(X.shape[0])
+        return affprop.labels_, affprop.cluster_centers_indices_
+
+
+class KNNGraphBackend:
+    """Spectral clustering of the sparse cosine k-nearest-neighbour graph. The graph has n * n_neighbors edges, so
+    memory grows linearly with the neighbourhood.
+    """
+    name = 'knn_graph'
+
+    def __init__(self, n_clusters: int = 8, n_neighbors: int = 10) -> None:
+        self.n_clusters = n_clusters
+        self.n_neighbors = n_neighbors
+
+    def fit(self, X) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Return the labels and the indices of the centers of the clustering of the rows of X."""
+        if X.shape[0] <= max(self.n_clusters, 1):
+            # Too few users for a graph to split, e.g. a lone user has no neighbours. Every user is its own cluster.
+            return numpy.arange(X.shape[0]), numpy.arange(X.shape[0])
+        n_neighbors = min(self.n_neighbors, X.shape[0] - 1)
+        graph = kneighbors_graph(X, n_neighbors, metric='cosine', mode='connectivity', include_self=False)
+        graph = graph.maximum(graph.T)
+        spectral = SpectralClustering(n_clusters=self.n_clusters, affinity='precomputed',
+                                      assign_labels='cluster_qr', random_state=0)
+        labels = spectral.fit_predict(graph)
+        # The center of a cluster is its best connected user.
+        degree = numpy.asarray(graph.sum(axis=1)).ravel()
+        centers = numpy.full(labels.max() + 1, -1)
+        for label in numpy.unique(labels):
+            members = numpy.flatnonzero(labels == label)
+            centers[label] = members[numpy.argmax(degree[members])]
+        return labels, centers
+
+
+class MiniBatchBackend:
+    """Mini-batch k-means on the L2 normalized rows, which approximates clustering by cosine distance. Works on
+    the sparse rows directly with memory linear in the neighbourhood.
+    """
+    name = 'mini_batch'
+
+    def __init__(self, n_clusters: int = 8, batch_size: int = 1024) -> None:
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+
+    def fit(self, X) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Return the labels and the indices of the centers of the clustering of the rows of X."""
+        X = normalize(X)
+        kmeans = MiniBatchKMeans(n_clusters=min(self.n_clusters, X.shape[0]), batch_size=self.batch_size,
+                                 n_init=3, random_state=0).fit(X)
+        # The center of a cluster is the user closest to its centroid.
+        return kmeans.labels_, pairwise_distances_argmin(kmeans.cluster_centers_, X)
+
+
+def default_backend(n_users: int):
+    """Return the backend suited to a neighbourhood of 'n_users' users."""
+    if n_users <= 2000:
+        return AffinityBackend()
+    if n_users <= 50000:
+        return KNNGraphBackend()
+    return MiniBatchBackend()
+
+
 class Cluster:
 
     vectors: Dict[str, Counter]
 
-    def __init__(self):
+    def __init__(self, backend=None):
+        """Creates a new Cluster. 'backend' is one of AffinityBackend, KNNGraphBackend or MiniBatchBackend; by
+        default it is picked by the number of users.
+        """
         self.vectors = OrderedDict()
+        self.backend = backend
+        self.dimensions = None
 
     def process_vectors(self, most=20):
-        dim = set()
+        """Choose the dimensions of the features: the union of the 'most' highest terms of every user. The counters
+        themselves are left untouched.
+        """
+        dim = OrderedDict()
         for vector in self.vectors.values():
             for k, _ in vector.most_common(most):
-                dim.add(k)
-        for vector in self.vectors.values():
-            for key in list(vector.keys()):
-                if key not in dim:
-                    del vector[key]
+                dim[k] = None
+        self.dimensions = list(dim)
 
-    def counter_to_array(self, counter: Counter) -> numpy.array:
-        return numpy.array([x for x in counter.values()])
+    def features(self) -> TermMatrix:
+        """Return the user x dimension feature matrix. Every row is aligned to the same shared vocabulary."""
+        if self.dimensions is None:
+            self.process_vectors()
+        return TermMatrix.from_counts(self.vectors, self.dimensions)
+
+    def matrix(self) -> scipy.sparse.csr_matrix:
+        """Return the features of every user as the rows of a sparse matrix."""
+        return self.features().matrix
 
     def clustering(self):
-        arrays = [self.counter_to_array(counter) for counter in self.vectors.values()]
-        # print(arrays)
-        return AffinityPropagation().fit(arrays)
+        return AffinityPropagation().fit(self.matrix().toarray())
+
     def clustering_cosine(self):
-        word_cosine = cosine_distances([self.counter_to_array(counter) for counter in self.vectors.values()])
-        print(word_cosine)
+        word_cosine = cosine_distances(self.matrix())
         affprop = AffinityPropagation(affinity='precomputed')
         return affprop.fit(word_cosine)
 
+    def cluster(self, backend=None) -> ClusterResult:
+        """Cluster the users with 'backend', or the backend of this Cluster, reporting the time and the peak memory
+        allocated while clustering.
+        """
+        X = self.matrix()
+        backend = backend or self.backend or default_backend(X.shape[0])
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            labels, centers = backend.fit(X)
+            seconds = time.perf_counter() - started
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return ClusterResult(backend.name, labels, centers, seconds, peak_bytes)
+
+    def groups(self, result) -> Dict[Tuple[int, str], List[str]]:
+        """Return the users of every cluster, keyed by the label and the user at the center of the cluster. Users
+        labelled -1, in no cluster, are left out.
+        """
+        users = list(self.vectors)
+        centers = [users[i] for i in result.cluster_centers_indices_]
+        groups = {}
+        for user, label in zip(users, result.labels_.tolist()):
+            if label < 0:
+                continue
+            groups.setdefault((label, centers[label]), []).append(user)
+        return groups
+
+
 if __name__ == "__main__":
     from datetime import datetime
     c = Cluster()
     w = WordFreq(datetime(2019, 3, 1), datetime(2019, 5, 1))
-    local = w.friends('jonLorraine9')
+    local = w.profile(w.friends('jonLorraine9'))
     _global = w.processed_local_plus_global_count(local)
     for user in local:
         c.vectors[user] = w.relative_frequency(user, _global)
     c.process_vectors()
-    print(c.vectors)
-    print([len(x) for x in c.vectors.values()])
-    clustering = c.clustering_cosine()
+    print(c.dimensions)
+    clustering = c.cluster()
+    print(clustering)
     print(clustering.labels_)
-    print(clustering.cluster_centers_)
     print(clustering.cluster_centers_indices_)
-    d = {}
-    for i in range(0, len(clustering.labels_)):
-        if (clustering.labels_[i], local[clustering.cluster_centers_indices_[clustering.labels_[i]]]) in d:
-            d[(clustering.labels_[i], local[clustering.cluster_centers_indices_[clustering.labels_[i]]])] += [local[i]]
-        else:
-            d[(clustering.labels_[i], local[clustering.cluster_centers_indices_[clustering.labels_[i]]])] = [local[i]]
-    print(d)
+    print(c.groups(clustering))
@@ -0,0 +1,36 @@
+import re
+from typing import List, Tuple, Dict, Union, Iterable
+
+
+class CommunityMatcher:
+    """Matches tweets against the keywords of a community. All keywords are compiled once into a single alternation,
+    so each tweet is searched once instead of once per keyword.
+    """
+
+    def __init__(self, keywords: Iterable[str]) -> None:
+        """Creates a new CommunityMatcher. Keywords are regular expressions, as stored in the keywords collection."""
+        self.keywords = list(keywords)
+        if self.keywords:
+            # A bit diff from sarah's regex but close enough
+            alternation = '|'.join('(?:' + keyword + ')' for keyword in self.keywords)
+            self.pattern = re.compile(r'(?i)\b(?:' + alternation + r')s?\b')
+        else:
+            self.pattern = None
+
+    def matches(self, text: str) -> bool:
+        """Return True if 'text' mentions any keyword of the community."""
+        return self.pattern is not None and self.pattern.search(text) is not None
+
+    def interest(self, timeline: Tuple[List[Tuple[str, str]], List[str]]) -> float:
+        """Return the fraction of the Tweets and Retweets of a timeline that mention a keyword."""
+        retweets, tweets = timeline
+        all_tweets = [retweet[0] for retweet in retweets] + tweets
+        if len(all_tweets) == 0:
+            return 0.0
+        return sum(1 for tweet in all_tweets if self.matches(tweet)) / len(all_tweets)
+
+    def interested_users(self, timelines: Dict[Union[str, int], Tuple[List[Tuple[str, str]], List[str]]],
+                         interest_threshold: float) -> List[Union[str, int]]:
+        """Return the users whose timelines reach the interest threshold, in the order of 'timelines'."""
+        return [user for user, timeline in timelines.items()
+                if (timeline[0] or timeline[1]) and self.interest(timeline) >= interest_threshold]
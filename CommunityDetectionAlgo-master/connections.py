@@ -0,0 +1,75 @@
+"""Process-wide registry of the MongoDB client and the Twitter API, shared by every handler.
+
+The client connects lazily on its first operation. A client inherited from a parent process is never reused,
+since pymongo clients are not fork-safe, so worker pools get their own client the first time they need one.
+"""
+import os
+import ssl
+import threading
+import pymongo
+import tweepy
+import keys
+from rate_limiter import RateLimiter
+
+settings = {
+    'mongo_uri': keys.mongo_key,
+    'max_pool_size': int(os.environ.get('MONGO_MAX_POOL_SIZE', 50)),
+}
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_api = None
+_limiter = None
+
+
+def configure(**kwargs) -> None:
+    """Change the settings used by clients created from now on, e.g. configure(max_pool_size=10)."""
+    for key in kwargs:
+        if key not in settings:
+            raise ValueError(f'Unknown connection setting {key}')
+    settings.update(kwargs)
+
+
+def get_client() -> pymongo.MongoClient:
+    """Return the MongoClient of this process, creating it if needed."""
+    global _client, _client_pid
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = pymongo.MongoClient(settings['mongo_uri'], ssl=True, ssl_cert_reqs=ssl.CERT_NONE,
+                                          maxPoolSize=settings['max_pool_size'], connect=False)
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_api() -> tweepy.API:
+    """Return the Twitter API of this process, creating it if needed."""
+    global _api
+    with _lock:
+        if _api is None:
+            auth = tweepy.OAuthHandler(keys.consumer_key, keys.consumer_secret_key)
+            auth.set_access_token(keys.access_token, keys.access_token_secret)
+            _api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
+        return _api
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the RateLimiter of the API returned by get_api. Rate limits are per account, so it is shared too."""
+    global _limiter
+    api = get_api()
+    with _lock:
+        if _limiter is None:
+            _limiter = RateLimiter(api.rate_limit_status)
+        return _limiter
+
+
+def _reset_after_fork() -> None:
+    """Forget the connections inherited from the parent process."""
+    global _lock, _client, _client_pid
+    _lock = threading.Lock()
+    _client = None
+    _client_pid = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,23 +1,47 @@
 import pymongo
 import tweepy_handler
-import keys
+import connections
+import text_processing
+import time_buckets
 import re
-import ssl
-from datetime import datetime
-from typing import List, Tuple, Union, Dict
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Tuple, Union, Dict, Optional
 from tweepy.error import TweepError
 import nltk
-from collections import Counter
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from timeline_cache import TimelineCache
+from community_matcher import CommunityMatcher
+from friend_graph import FriendGraph
+from util import BatchCount
 
 
 
 class DatabaseHandler:
     """Wrapper class for the get_tweets function and get_keywords."""
 
-    def __init__(self):
-        """Initializes a new DatabaseHandler."""
-        self.client = pymongo.MongoClient(keys.mongo_key, ssl=True, ssl_cert_reqs=ssl.CERT_NONE)
-        self.th = tweepy_handler.TweepyHandler()
+    def __init__(self, timeline_cache: TimelineCache = None, client: pymongo.MongoClient = None,
+                 th: tweepy_handler.TweepyHandler = None, dead_ttl: timedelta = timedelta(days=1)):
+        """Initializes a new DatabaseHandler. Timelines are cached in 'timeline_cache' in front of MongoDB.
+        The MongoClient is the process-wide one from connections unless 'client' is given, e.g. a local mongod.
+        It only connects on the first query. The indexes the queries rely on are created by running schema.py.
+        Private, suspended and deleted accounts are skipped for 'dead_ttl' after they were last seen that way.
+        """
+        self.client = client if client is not None else connections.get_client()
+        self.th = th if th is not None else tweepy_handler.TweepyHandler()
+        self.timeline_cache = timeline_cache if timeline_cache is not None else TimelineCache()
+        self._matchers = {}
+        # Seconds a community's matcher is used before its keywords are read again.
+        self.matcher_ttl = 600.0
+        self._global_counts = {}
+        self.friend_graph = FriendGraph(self.client, self.th)
+        self.dead_ttl = dead_ttl
+        self._dead = {}
+        # Number of API calls that weren't made, by reason.
+        self.calls_saved = Counter()
+        self._calls_saved_lock = threading.Lock()
 
     def get_keywords(self, community: str) -> List[str]:
         """Returns a list of all keywords belonging to a given community.
@@ -30,35 +54,225 @@ class DatabaseHandler:
         except TypeError:
             print("community was not found")
 
+    def get_friends(self, user: Union[str, int]) -> List[str]:
+        """Return the screen names of the users that 'user' follows, from the friend graph logged in the mongoDB.
+        Only adjacency lists that are out of date and ids never seen before are gathered from tweepy.
+        """
+        return self.friend_graph.get_friends(user)
+
     def get_tweets(self, user: Union[str, int], start: datetime, end: datetime) \
             -> Tuple[List[Tuple[str, str]], List[str]]:
         """Returns the full doc of Retweets (with the author of the original Tweet) and Tweets of a user
         within a timeframe.
-        If this data is not logged in the mongoDB yet, it gathers this data from tweepy; if already logged,
-        it takes this data from the mongoDB.
-        Users with suspended/deleted accounts will be logged in the mongoDB with their id value as -1.
+        The timeframe is answered from the user's statuses logged in the mongoDB. Only the statuses newer or older
+        than what is already logged are gathered from tweepy. Timeframes logged in the users collection, from before
+        statuses were logged one by one, are answered from there unless the logged statuses reach back further.
+        Users with private/suspended/deleted accounts will return empty Tweets and Retweets. If tweepy fails for
+        another reason, the Tweets and Retweets logged so far are returned and not cached.
+        """
+        timeline = self.timeline_cache.get(user, start, end)
+        if timeline is not None:
+            return timeline
+        try:
+            timeline = self._get_tweets(user, start, end)
+        except TweepError as e:
+            print('TweepError on', user, e)
+            return self._get_logged_tweets(user, start, end)
+        self.timeline_cache.put(user, start, end, timeline)
+        return timeline
+
+    def _get_tweets(self, user: Union[str, int], start: datetime, end: datetime) \
+            -> Tuple[List[Tuple[str, str]], List[str]]:
+        """Helper method for get_tweets that bypasses the timeline cache."""
+        # The API only returns the newest 3200 statuses, older timeframes may only be in the users collection.
+        legacy = self._get_legacy_tweets(user, start, end)
+        if legacy is not None and not self._statuses_reach(user, start):
+            return legacy
+        state = self.sync_timeline(user, start, end)
+        if state is None:
+            return [], []
+        return self._query_statuses(state['id'], start, end)
+
+    def _get_logged_tweets(self, user: Union[str, int], start: datetime, end: datetime) \
+            -> Tuple[List[Tuple[str, str]], List[str]]:
+        """Returns the Retweets and Tweets of a user within a timeframe that are logged in the mongoDB, without
+        syncing.
+        """
+        state = self.client['productionFunction']['timelines'].find_one(self._timeline_query(user))
+        if state is None:
+            return [], []
+        return self._query_statuses(state['id'], start, end)
+
+    @staticmethod
+    def _timeline_query(user: Union[str, int]) -> Dict:
+        """Returns the query of a user's sync state. Screen names are matched case-insensitively, like Twitter does,
+        the exact 'handle' only matches states stored before 'handle_lower' was.
+        """
+        if isinstance(user, str):
+            return {"$or": [{"handle_lower": user.lower()}, {"handle": user}]}
+        return {"id": user}
+
+    def _query_statuses(self, user_id: int, start: datetime, end: datetime) \
+            -> Tuple[List[Tuple[str, str]], List[str]]:
+        """Returns the Retweets and Tweets of the user with id 'user_id' logged in the statuses collection."""
+        statuses_col = self.client['productionFunction']['statuses']
+        query = {'user_id': user_id, 'created_at': {'$gte': start, '$lt': end}}
+        retweets = []
+        tweets = []
+        for doc in statuses_col.find(query).sort('created_at', pymongo.DESCENDING):
+            if doc['retweet'] is not None:
+                retweets.append(tuple(doc['retweet']))
+            else:
+                tweets.append(doc['text'])
+        return retweets, tweets
+
+    def _get_legacy_tweets(self, user: Union[str, int], start: datetime, end: datetime) \
+            -> Optional[Tuple[List[Tuple[str, str]], List[str]]]:
+        """Returns the Retweets and Tweets of a user logged in the users collection for exactly this timeframe, or
+        None if that timeframe was never logged there.
         """
-        # First check if mongodb has what we need.
         users_col = self.client['productionFunction']['users']
-        query = {"$or": [{"handle": user}, {"id": user}], "start": start, "end": end}
-        user_doc = users_col.find_one(query)
+        user_doc = users_col.find_one({"$or": [{"handle": user}, {"id": user}], "start": start, "end": end})
         if user_doc is None:
-            # Make a tweepy call if the database doesn't have this info yet.
-            retweets, tweets = self.th.get_tweets(user, start, end)
-            try:
-                user_data = self.th.api.get_user(user)
-                d = {"handle": user_data.screen_name, "id": user_data.id, "start": start, "end": end,
-                     "retweets": retweets,
-                     "tweets": tweets}
-            except TweepError:
-                print(user, "does not exist")
-                d = {"handle": user, "id": -1, "start": start, "end": end, "retweets": retweets, "tweets": tweets}
-            users_col.insert_one(d)
-            return retweets, tweets
-        else:
-            if user_doc['id'] == -1:
-                print(user, "does not exist")
-            return user_doc['retweets'], user_doc['tweets']
+            return None
+        if user_doc['id'] == -1:
+            print(user, "does not exist")
+        return [tuple(retweet) for retweet in user_doc['retweets']], user_doc['tweets']
+
+    def _statuses_reach(self, user: Union[str, int], start: datetime) -> bool:
+        """Returns True if a status of the user created before 'start' is logged, so every status from 'start' on
+        is logged too.
+        """
+        state = self.client['productionFunction']['timelines'].find_one(self._timeline_query(user))
+        if state is None:
+            return False
+        statuses_col = self.client['productionFunction']['statuses']
+        return statuses_col.find_one({'user_id': state['id'], 'created_at': {'$lt': start}}) is not None
+
+    def get_tweets_many(self, users: List[Union[str, int]], start: datetime, end: datetime) \
+            -> Dict[Union[str, int], Tuple[List[Tuple[str, str]], List[str]]]:
+        """Returns the Retweets and Tweets of every user within a timeframe, as a dictionary keyed by user.
+        Timelines are synced concurrently.
+        """
+        users = list(OrderedDict.fromkeys(users))
+        with ThreadPoolExecutor(self.th.max_workers) as pool:
+            return dict(zip(users, pool.map(lambda user: self.get_tweets(user, start, end), users)))
+
+    def sync_timeline(self, user: Union[str, int], start: datetime, end: datetime) -> Optional[Dict]:
+        """Makes sure every status of a user within a timeframe is logged in the mongoDB and returns the user's sync
+        state. Returns None if the user's account is private, suspended or deleted. Other TweepErrors are raised,
+        and the sync state is then left as it was.
+
+        The sync state records the newest and oldest logged status ids and the time range they cover, so only
+        statuses newer than 'newest_id' (with since_id) or older than 'oldest_id' (with max_id) are ever fetched.
+        """
+        timelines_col = self.client['productionFunction']['timelines']
+        state = timelines_col.find_one(self._timeline_query(user))
+        if self.is_dead(user):
+            self._count_saved('dead')
+            return state
+        now = datetime.utcnow()
+        try:
+            if state is None:
+                statuses, exhausted = self.th.get_statuses(user, until=start)
+                # The user's identity comes with every status, only an empty timeline needs a lookup.
+                if statuses:
+                    user_id, handle = statuses[0].user.id, statuses[0].user.screen_name
+                    self._count_saved('get_user')
+                else:
+                    user_id = self.friend_graph.user_id(user)
+                    names = self.friend_graph.screen_names([user_id]) if user_id is not None else []
+                    if not names:
+                        self.mark_dead(user, user_id)
+                        return None
+                    handle = names[0]
+                state = {'handle': handle, 'id': user_id, 'newest_id': None, 'oldest_id': None,
+                         'covered_from': datetime.min, 'synced_at': now, 'exhausted': exhausted}
+                if statuses:
+                    state['newest_id'] = statuses[0].id
+                    state['oldest_id'] = statuses[-1].id
+                    if not exhausted:
+                        state['covered_from'] = statuses[-1].created_at
+                self._store_statuses(statuses)
+            else:
+                if end > state['synced_at']:
+                    statuses, _ = self.th.get_statuses(state['id'], since_id=state['newest_id'])
+                    if statuses:
+                        state['newest_id'] = statuses[0].id
+                        if state['oldest_id'] is None:
+                            state['oldest_id'] = statuses[-1].id
+                    state['synced_at'] = now
+                    self._store_statuses(statuses)
+                if start < state['covered_from'] and not state['exhausted']:
+                    statuses, exhausted = self.th.get_statuses(state['id'], max_id=state['oldest_id'] - 1,
+                                                               until=start)
+                    if statuses:
+                        state['oldest_id'] = statuses[-1].id
+                    state['covered_from'] = datetime.min if exhausted else statuses[-1].created_at
+                    state['exhausted'] = exhausted
+                    self._store_statuses(statuses)
+        except TweepError as e:
+            if not tweepy_handler.account_unavailable(e):
+                raise
+            print(user, "does not exist")
+            if state is None or 'id' not in state:
+                self.mark_dead(user)
+                return None
+            self.mark_dead(user, state['id'], state['handle'])
+        state['handle_lower'] = state['handle'].lower()
+        timelines_col.replace_one({'id': state['id']}, state, upsert=True)
+        return state
+
+    def _count_saved(self, reason: str) -> None:
+        """Count an API call that wasn't made, from any thread."""
+        with self._calls_saved_lock:
+            self.calls_saved[reason] += 1
+
+    def saved_calls(self) -> Counter:
+        """Returns a copy of the number of API calls that weren't made, by reason."""
+        with self._calls_saved_lock:
+            return Counter(self.calls_saved)
+
+    def is_dead(self, user: Union[str, int]) -> bool:
+        """Returns True if the user's account was found private, suspended or deleted within the last 'dead_ttl'."""
+        key = user.lower() if isinstance(user, str) else user
+        expires_at = self._dead.get(key)
+        if expires_at is None:
+            doc = self.client['productionFunction']['deadAccounts'].find_one({'_id': key})
+            expires_at = doc['expires_at'] if doc is not None else datetime.min
+            self._dead[key] = expires_at
+        return expires_at > datetime.utcnow()
+
+    def mark_dead(self, *users: Union[str, int, None]) -> None:
+        """Logs that the account of the given users, e.g. the id and screen name of the same user, is private,
+        suspended or deleted, so it is skipped for 'dead_ttl' whichever way it is asked for. None is ignored.
+        The mongoDB drops the entries once they expire.
+        """
+        expires_at = datetime.utcnow() + self.dead_ttl
+        dead_col = self.client['productionFunction']['deadAccounts']
+        for key in OrderedDict.fromkeys(user.lower() if isinstance(user, str) else user for user in users):
+            if key is None:
+                continue
+            self._dead[key] = expires_at
+            dead_col.replace_one({'_id': key}, {'expires_at': expires_at}, upsert=True)
+
+    def _store_statuses(self, statuses: List) -> None:
+        """Logs statuses gathered from tweepy in the mongoDB, keyed by status id."""
+        if not statuses:
+            return
+        statuses_col = self.client['productionFunction']['statuses']
+        requests = []
+        for status in statuses:
+            if 'retweeted_status' in status._json:
+                # retweet = (full doc of rwt, original author)
+                retweet = [status._json['retweeted_status']['full_text'],
+                           status._json['retweeted_status']['user']['screen_name']]
+            else:
+                retweet = None
+            doc = {'_id': status.id, 'user_id': status.user.id, 'created_at': status.created_at,
+                   'text': status._json['full_text'], 'retweet': retweet}
+            requests.append(pymongo.UpdateOne({'_id': status.id}, {'$setOnInsert': doc}, upsert=True))
+        statuses_col.bulk_write(requests, ordered=False)
 
     def timeline_to_document(self, user: Union[str, int], start: datetime, end: datetime) -> str:
         """Returns the concatentation of all the tweets/retweets as one string."""
@@ -71,76 +285,130 @@ class DatabaseHandler:
             doc += tweet + " "
 
         # print(doc)
-        doc = re.sub(r"\bhttps:\S*\b", "", doc)
-        doc = re.sub(r"\b\d*\b", "", doc)
-        #leave handle
-        doc = re.sub(r"[^\w\s@]", "", doc)
-        return doc
+        return text_processing.clean_text(doc)
         # return text_to_words(doc)
 
+    def get_matcher(self, community: str) -> CommunityMatcher:
+        """Returns the keyword matcher of a community. Matchers are cached for 'matcher_ttl' seconds, or until
+        invalidate_matcher is called. A community without keywords isn't cached, so it is read again once populated.
+        """
+        entry = self._matchers.get(community)
+        if entry is not None and time.monotonic() - entry[1] < self.matcher_ttl:
+            return entry[0]
+        keywords = self.get_keywords(community) or []
+        matcher = CommunityMatcher(keywords)
+        if keywords:
+            self._matchers[community] = (matcher, time.monotonic())
+        else:
+            self._matchers.pop(community, None)
+        return matcher
+
+    def invalidate_matcher(self, community: str = None) -> None:
+        """Forgets the cached matcher of a community, or of every community, e.g. after its keywords changed."""
+        if community is None:
+            self._matchers.clear()
+        else:
+            self._matchers.pop(community, None)
+
     def user_in_comm(self, user: Union[str, int], community: str, start_date: datetime, end_date: datetime,
                      interest_threshold: int = 0.05) -> bool:
         """Returns True if a user is considered a part of the community based on their tweets within a timeframe and
         the interest threshold. Returns False otherwise.
         """
-        keywords = self.get_keywords(community)
+        matcher = self.get_matcher(community)
         # TODO remove from final product
         print("currently checking:", user)
         retweets, tweets = self.get_tweets(user, start_date, end_date)
-        all_tweets = [retweet[0] for retweet in retweets] + tweets
-        int_twts = 0
-        if len(all_tweets) == 0:
+        if len(retweets) + len(tweets) == 0:
             return False
-        for tweet in all_tweets:
-            for keyword in keywords:
-                # A bit diff from sarah's regex but close enough
-                re_keyword = r'(?i)\b' + keyword + r's?\b'
-                if re.search(re_keyword, tweet) is not None:
-                    print('key:', keyword, 'tweet:', tweet)
-                    int_twts += 1
-                    break
-        print(int_twts, len(all_tweets), int_twts/len(all_tweets))
-        return int_twts / len(all_tweets) >= interest_threshold
+        interest = matcher.interest((retweets, tweets))
+        print(user, len(retweets) + len(tweets), interest)
+        return interest >= interest_threshold
+
+    def users_in_comm(self, users: List[Union[str, int]], community: str, start_date: datetime, end_date: datetime,
+                      interest_threshold: int = 0.05) -> List[Union[str, int]]:
+        """Returns the users that are considered a part of the community, in the order given. Same as user_in_comm
+        for every user, but the timelines are fetched as one batch.
+        """
+        timelines = self.get_tweets_many(users, start_date, end_date)
+        return self.get_matcher(community).interested_users(timelines, interest_threshold)
 
     def get_label_graph(self, community: str, ranking_type: str, start, end) -> Dict:
         """Gets the label graph of a given community stored in MongoDB for consumption/production utility.
+        Every edge of the graph is stored as its own document in labelGraphEdges.
         """
-        graph_col = self.client['productionFunction']['labelGraphs']
-        d = graph_col.find_one_and_update({'community': community, 'ranking_type': ranking_type,
-                                           'timeframe': (start, end), 'map': {'$exists': True}},
-                                          {'$setOnInsert': {'map': {}}},
-                                          upsert=True, return_document=True)
-        print(d)
-        return d
+        edges_col = self.client['productionFunction']['labelGraphEdges']
+        edges = edges_col.find({'community': community, 'ranking_type': ranking_type, 'start': start, 'end': end},
+                               {'node': 1, 'parent': 1, '_id': 0})
+        return {'community': community, 'ranking_type': ranking_type, 'timeframe': (start, end),
+                'map': {edge['node']: edge['parent'] for edge in edges}}
 
     def add_path_to_label_graph(self, path: List[str], community: str, ranking_type: str, start: datetime,
                                 end: datetime) -> None:
         """Add path to label graph stored in MongoDB. Create a label graph if it doesn't exist."""
-        collection = self.client['productionFunction']['labelGraphs']
-        for i in range(0, len(path)):
-            if i < len(path) - 1:
-                collection.update_one({'community': community, 'ranking_type': ranking_type,
-                                       'timeframe': (start, end)
-                                       },
-                                      {'$set': {'map.' + path[i]: path[i + 1]}
-                                       }, upsert=True)
-            else:
-                collection.update_one({'community': community, 'ranking_type': ranking_type,
-                                       'timeframe': (start, end)
-                                       },
-                                      {'$set': {'map.' + path[i]: path[i]}
-                                       }, upsert=True)
+        self.add_paths_to_label_graph([path], community, ranking_type, start, end)
+
+    def add_paths_to_label_graph(self, paths: List[List[str]], community: str, ranking_type: str, start: datetime,
+                                 end: datetime) -> None:
+        """Add every path to the label graph stored in MongoDB with a single unordered bulk write. A node that
+        appears in several paths gets the parent of the last path it appears in.
+        """
+        edges = {}
+        for path in paths:
+            for i in range(0, len(path)):
+                edges[path[i]] = path[i + 1] if i < len(path) - 1 else path[i]
+        if not edges:
+            return
+        edges_col = self.client['productionFunction']['labelGraphEdges']
+        edges_col.bulk_write([pymongo.UpdateOne({'community': community, 'ranking_type': ranking_type,
+                                                 'start': start, 'end': end, 'node': node},
+                                                {'$set': {'parent': parent}}, upsert=True)
+                              for node, parent in edges.items()], ordered=False)
 
     def get_global_freq(self):
         # should store raw data
         global_data = self.client['globalData']['wordCount']
-        global_dict = global_data.find_one()
+        global_dict = global_data.find_one() or {'_id': None}
         global_data2 = self.client['globalData']['wordCount1']
-        global_dict2 = global_data2.find_one()
+        global_dict2 = global_data2.find_one() or {'_id': None}
         del global_dict['_id']
         del global_dict2['_id']
         return Counter(global_dict) + Counter(global_dict2)
 
+    def get_global_count(self, start: datetime = None, end: datetime = None) -> BatchCount:
+        """Returns the global word count of tweets created within a timeframe, from the fewest hour/day/week/month
+        buckets that cover it. Without a timeframe, returns the global count logged before counts were bucketed plus
+        every month bucket. A timeframe with only a start or an end runs to the last or from the first hour bucket. Results
+        are cached, a copy is returned so the caller can modify it.
+        """
+        key = (start, end)
+        if key not in self._global_counts:
+            buckets_col = self.client['globalData']['wordBuckets']
+            if start is None and end is None:
+                count = BatchCount(self.get_global_freq())
+                query = {'granularity': 'month'}
+            else:
+                count = BatchCount(Counter(), 0)
+                starts = {}
+                # A window open on one side runs from the first or to the last hour bucket.
+                if start is None:
+                    first = buckets_col.find_one({'granularity': 'hour'}, sort=[('start', pymongo.ASCENDING)])
+                    start = first['start'] if first is not None else end
+                if end is None:
+                    last = buckets_col.find_one({'granularity': 'hour'}, sort=[('start', pymongo.DESCENDING)])
+                    end = time_buckets.bucket_end(last['start'], 'hour') if last is not None else start
+                for granularity, bucket in time_buckets.cover(start, end):
+                    starts.setdefault(granularity, []).append(bucket)
+                query = {'$or': [{'granularity': granularity, 'start': {'$in': buckets}}
+                                 for granularity, buckets in starts.items()]} if starts else None
+            # Every shard of a bucket holds different words.
+            for doc in (buckets_col.find(query) if query is not None else []):
+                count.counter.update(doc['counts'])
+                count.total += doc['total']
+            self._global_counts[key] = count
+        cached = self._global_counts[key]
+        return BatchCount(Counter(cached.counter), cached.total)
+
     def word_to_global_count(self, word: str) -> None:
         global_count = self.client['globalData']['wordCount1']
         global_dict = global_count.find_one()
@@ -148,6 +416,40 @@ class DatabaseHandler:
             global_count.insert_one({})
         global_count.update_one({}, {'$inc': {word: 1}})
 
+    def add_to_global_count(self, counter: Counter, created_at: datetime = None) -> None:
+        """Add a whole batch of word counts of tweets created at 'created_at' to the global count."""
+        self.add_to_global_counts({None if created_at is None else time_buckets.bucket_start(created_at, 'hour'):
+                                   counter})
+
+    def add_to_global_counts(self, counts: Dict[Optional[datetime], Counter]) -> None:
+        """Add the word counts of every hour bucket to the global count, and to the day, week and month buckets
+        rolling them up, with a single bulk write. Every bucket is split into time_buckets.SHARDS documents by word.
+        Counts of tweets without a time (key None) are added to the global count logged before counts were bucketed.
+        """
+        rolled_up = {}
+        for hour, counter in counts.items():
+            if not counter:
+                continue
+            if hour is None:
+                global_count = self.client['globalData']['wordCount1']
+                global_count.update_one({}, {'$inc': dict(counter)}, upsert=True)
+                continue
+            for bucket in time_buckets.rollups(hour):
+                rolled_up.setdefault(bucket, Counter()).update(counter)
+        if not rolled_up:
+            return
+        requests = []
+        for (granularity, start), counter in rolled_up.items():
+            shards = {}
+            for word, count in counter.items():
+                shards.setdefault(time_buckets.shard(word), {})['counts.' + word] = count
+            for shard, inc in shards.items():
+                inc['total'] = sum(inc.values())
+                requests.append(pymongo.UpdateOne({'granularity': granularity, 'start': start, 'shard': shard},
+                                                  {'$inc': inc}, upsert=True))
+        self.client['globalData']['wordBuckets'].bulk_write(requests, ordered=False)
+        self._global_counts.clear()
+
 
 def text_to_words(text):
     words = re.sub(r"\bhttps:\S*\b", "", text.lower())
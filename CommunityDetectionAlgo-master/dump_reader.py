@@ -0,0 +1,115 @@
+"""Lazy reader of newline-delimited JSON tweet dumps, e.g. the files saved from the stream.
+
+Dumps are memory-mapped and read one line at a time, keeping only the fields the word counts need, so reading a file
+takes no more memory than the line being parsed. Lines are parsed with orjson when it is installed.
+"""
+import json
+import mmap
+import os
+from datetime import datetime
+from typing import NamedTuple, Optional, Generator, List, Tuple
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# created_at of statuses, always in UTC.
+TWITTER_TIME_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+_MONTHS = {month: i for i, month in enumerate(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+                                               'Nov', 'Dec'], 1)}
+
+
+class Status(NamedTuple):
+    id: Optional[int]
+    text: str
+    user: Optional[str]
+    created_at: Optional[datetime]
+
+
+def parse_created_at(created_at: str) -> datetime:
+    """Return the datetime of a created_at string in TWITTER_TIME_FORMAT. Faster than strptime since the format is
+    fixed, e.g. 'Mon Jun 28 17:30:00 +0000 2021'.
+    """
+    if len(created_at) != 30 or created_at[19:26] != ' +0000 ':
+        return datetime.strptime(created_at, TWITTER_TIME_FORMAT)
+    try:
+        return datetime(int(created_at[26:]), _MONTHS[created_at[4:7]], int(created_at[8:10]),
+                        int(created_at[11:13]), int(created_at[14:16]), int(created_at[17:19]))
+    except KeyError:
+        raise ValueError(f'Invalid created_at {created_at}')
+
+
+def parse_status(line: bytes) -> Optional[Status]:
+    """Return the Status on one line of a dump, or None if the line is not a tweet."""
+    try:
+        tweet = _loads(line)
+        if 'extended_tweet' in tweet:
+            text = tweet['extended_tweet']['full_text']
+        elif 'retweeted_status' in tweet:
+            text = tweet['retweeted_status']['text']
+        else:
+            text = tweet['text']
+    # JSONDecodeError of either parser, and UnicodeDecodeError, are ValueErrors.
+    except ValueError:
+        return None
+    # Not a status, e.g. the limit and delete notices of the stream.
+    except (TypeError, KeyError):
+        return None
+    try:
+        created_at = parse_created_at(tweet['created_at'])
+    except (KeyError, TypeError, ValueError):
+        created_at = None
+    try:
+        user = tweet['user']['screen_name']
+    except (KeyError, TypeError):
+        user = None
+    return Status(tweet.get('id'), text, user, created_at)
+
+
+def read_lines(filepath: str, start: int = 0, end: int = None) -> Generator[Tuple[int, bytes], None, None]:
+    """Yield the byte offset and contents of every line in 'filepath' that starts within the byte range [start, end).
+    Ranges that split a file can be read by separate readers, every line is read by exactly one of them.
+    """
+    if os.path.getsize(filepath) == 0:
+        return
+    with open(filepath, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as dump:
+        size = len(dump)
+        end = size if end is None else min(end, size)
+        pos = 0
+        if start > 0:
+            # Skip the line that started before this range, it belongs to the previous one.
+            pos = dump.find(b'\n', start - 1) + 1 or size
+        while pos < end:
+            newline = dump.find(b'\n', pos)
+            if newline == -1:
+                newline = size
+            yield pos, dump[pos:newline]
+            pos = newline + 1
+
+
+def read_lines_at(filepath: str, offsets: List[int]) -> Generator[bytes, None, None]:
+    """Yield the contents of the lines of 'filepath' starting at the given byte offsets, as yielded by read_lines."""
+    with open(filepath, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as dump:
+        for offset in offsets:
+            newline = dump.find(b'\n', offset)
+            yield dump[offset:newline if newline != -1 else len(dump)]
+
+
+def read_dump(filepath: str, start: int = 0, end: int = None) -> Generator[Status, None, None]:
+    """Yield the Status of every tweet in 'filepath' whose line starts within the byte range [start, end)."""
+    for _, line in read_lines(filepath, start, end):
+        status = parse_status(line)
+        if status is not None:
+            yield status
+
+
+def split_dumps(filepaths: List[str], chunk_bytes: int) -> List[Tuple[str, int, int]]:
+    """Return (filepath, start, end) byte ranges of at most 'chunk_bytes' covering every file."""
+    ranges = []
+    for filepath in filepaths:
+        size = os.path.getsize(filepath)
+        for start in range(0, size, chunk_bytes):
+            ranges.append((filepath, start, min(start + chunk_bytes, size)))
+    return ranges
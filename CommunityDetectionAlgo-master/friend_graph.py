@@ -0,0 +1,122 @@
+import threading
+import pymongo
+from datetime import datetime, timedelta
+from typing import List, Union, Optional, Iterable
+from tweepy_handler import TweepyHandler
+
+
+class FriendGraph:
+    """Persistent store of the accounts every user follows. Adjacency lists are kept by numeric id with the time
+    they were fetched, and screen names are interned in one global id <-> screen name table. The API is only called
+    for adjacency lists older than 'max_age' and for ids whose screen name was never seen. Ids and screen names the
+    API didn't find are remembered as missing for 'max_age' too, so they aren't looked up again every time.
+    """
+
+    def __init__(self, client: pymongo.MongoClient, th: TweepyHandler, max_age: timedelta = timedelta(days=7)) \
+            -> None:
+        """Creates a new FriendGraph stored in the productionFunction database of 'client'."""
+        self.friends_col = client['productionFunction']['friends']
+        self.names_col = client['productionFunction']['screenNames']
+        # Ids and lowercase screen names of accounts that don't exist, until 'expires_at'.
+        self.missing_col = client['productionFunction']['missingUsers']
+        self.th = th
+        self.max_age = max_age
+        self._names = {}
+        self._ids = {}
+        self._friends = {}
+        self._missing = {}
+        self._lock = threading.Lock()
+
+    def _intern(self, user_id: int, screen_name: str) -> None:
+        with self._lock:
+            self._names[user_id] = screen_name
+            self._ids[screen_name.lower()] = user_id
+
+    def _remember(self, users: Iterable) -> None:
+        """Intern the users returned by the API, and store them."""
+        requests = []
+        for user in users:
+            self._intern(user.id, user.screen_name)
+            requests.append(pymongo.UpdateOne({'_id': user.id},
+                                              {'$set': {'screen_name': user.screen_name,
+                                                        'lower': user.screen_name.lower()}}, upsert=True))
+        if requests:
+            self.names_col.bulk_write(requests, ordered=False)
+
+    def _is_missing(self, keys: List[Union[int, str]]) -> List[Union[int, str]]:
+        """Return the keys, ids or lowercase screen names, that were recently not found by the API."""
+        now = datetime.utcnow()
+        missing = [key for key in keys if self._missing.get(key, now) > now]
+        unknown = [key for key in keys if key not in self._missing]
+        if unknown:
+            for doc in self.missing_col.find({'_id': {'$in': unknown}, 'expires_at': {'$gt': now}}):
+                with self._lock:
+                    self._missing[doc['_id']] = doc['expires_at']
+                missing.append(doc['_id'])
+        return missing
+
+    def _mark_missing(self, keys: List[Union[int, str]]) -> None:
+        """Remember that the API didn't find the keys, ids or lowercase screen names, for 'max_age'."""
+        if not keys:
+            return
+        expires_at = datetime.utcnow() + self.max_age
+        with self._lock:
+            for key in keys:
+                self._missing[key] = expires_at
+        self.missing_col.bulk_write([pymongo.ReplaceOne({'_id': key}, {'expires_at': expires_at}, upsert=True)
+                                     for key in keys], ordered=False)
+
+    def user_id(self, user: Union[str, int]) -> Optional[int]:
+        """Return the id of a user given by id or screen name, or None if the account doesn't exist."""
+        if isinstance(user, int):
+            return user
+        user_id = self._ids.get(user.lower())
+        if user_id is not None:
+            return user_id
+        doc = self.names_col.find_one({'lower': user.lower()})
+        if doc is not None:
+            self._intern(doc['_id'], doc['screen_name'])
+            return doc['_id']
+        if self._is_missing([user.lower()]):
+            return None
+        self._remember(self.th.lookup_users(screen_names=[user]))
+        user_id = self._ids.get(user.lower())
+        if user_id is None:
+            self._mark_missing([user.lower()])
+        return user_id
+
+    def screen_names(self, ids: List[int]) -> List[str]:
+        """Return the screen names of the given ids, in order. Ids of accounts that no longer exist are left out."""
+        missing = [user_id for user_id in ids if user_id not in self._names]
+        if missing:
+            for doc in self.names_col.find({'_id': {'$in': missing}}):
+                self._intern(doc['_id'], doc['screen_name'])
+            missing = [user_id for user_id in missing if user_id not in self._names]
+        if missing:
+            gone = set(self._is_missing(missing))
+            missing = [user_id for user_id in missing if user_id not in gone]
+        if missing:
+            self._remember(self.th.lookup_users(ids=missing))
+            self._mark_missing([user_id for user_id in missing if user_id not in self._names])
+        return [self._names[user_id] for user_id in ids if user_id in self._names]
+
+    def friend_ids(self, user: Union[str, int]) -> List[int]:
+        """Return the ids of the accounts a user follows, from the store unless it is older than 'max_age'."""
+        user_id = self.user_id(user)
+        if user_id is None:
+            return []
+        now = datetime.utcnow()
+        entry = self._friends.get(user_id)
+        if entry is None:
+            doc = self.friends_col.find_one({'_id': user_id})
+            if doc is not None:
+                entry = (doc['friends'], doc['fetched_at'])
+        if entry is None or now - entry[1] > self.max_age:
+            entry = (self.th.get_friend_ids(user_id), now)
+            self.friends_col.replace_one({'_id': user_id}, {'friends': entry[0], 'fetched_at': now}, upsert=True)
+        self._friends[user_id] = entry
+        return entry[0]
+
+    def get_friends(self, user: Union[str, int]) -> List[str]:
+        """Return the screen names of the accounts a user follows."""
+        return self.screen_names(self.friend_ids(user))
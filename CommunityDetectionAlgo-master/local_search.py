@@ -1,8 +1,10 @@
 from datetime import datetime
 from util import LocalSearchMap
 from database_handler import DatabaseHandler
-from tweepy_handler import TweepyHandler
-from typing import List, Tuple
+from scoring import RetweetMatrix
+from typing import List, Tuple, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 from collections import OrderedDict
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import AffinityPropagation
@@ -10,22 +12,29 @@ from sklearn.cluster import AffinityPropagation
 class Ranking:
     """Class hosting the ranking functions."""
 
-    def __init__(self, start_date: datetime, end_date: datetime):
-        """Creates a new Ranking class instance based on a particular timeframe."""
+    def __init__(self, start_date: datetime, end_date: datetime, search_map: type = LocalSearchMap,
+                 db: DatabaseHandler = None):
+        """Creates a new Ranking class instance based on a particular timeframe. 'search_map' is the LocalSearchMap
+        representation used for label graphs, e.g. CompactLocalSearchMap for very large communities.
+        The DatabaseHandler and its TweepyHandler are shared with 'db' if given.
+        """
         self.start_date = start_date
         self.end_date = end_date
-        self.th = TweepyHandler()
-        self.db = DatabaseHandler()
+        self.search_map = search_map
+        self.db = db if db is not None else DatabaseHandler()
+        self.th = self.db.th
 
     def local_nbhd(self, agent: str, community: str) -> List[str]:
         """Return a list of screen names of users who are in the local neighbourhood of the 'agent'.
         'agent' will be the first screen name in the list."""
-        local = [friend for friend in self.th.get_friends(agent)
-                 if self.db.user_in_comm(friend, community, self.start_date, self.end_date)]
+        saved = self.db.saved_calls()
+        friends = self.db.get_friends(agent)
+        local = self.db.users_in_comm(friends, community, self.start_date, self.end_date)
+        print('API calls saved on the neighbourhood of', agent, ':', dict(self.db.saved_calls() - saved))
         return [agent] + local
 
     def user_friends(self, agent):
-        local = [friend for friend in self.th.get_friends(agent)]
+        local = self.db.get_friends(agent)
         return [agent] + local
 
     def search_by_consumption(self, seed: str, community: str) -> List[str]:
@@ -38,35 +47,97 @@ class Ranking:
         the seed user."""
         return self._search_by_utility('production', seed, community)
 
+    def search_many(self, seeds: List[str], community: str, utility_type: str, max_workers: int = None) \
+            -> Dict[str, List[str]]:
+        """Find the core of a community from every seed concurrently and return the path taken from each seed.
+        The climbs share one in-memory LocalSearchMap and the local max of every node, so a climb that reaches a node
+        already resolved, or being resolved, by another climb waits for and reuses its result. New paths are persisted
+        once at the end, even if the climb from a seed fails.
+        """
+        db_map = self.db.get_label_graph(community, utility_type, self.start_date, self.end_date)
+        ls_map = self.search_map(db_map['map'], community, utility_type, self.start_date, self.end_date)
+        local_maxes = {}
+        lock = threading.Lock()
+        new_paths = []
+
+        def search(seed: str) -> List[str]:
+            path, new = self._climb(utility_type, seed, community, ls_map, local_maxes, lock)
+            if new:
+                ls_map.add_path(path)
+                new_paths.append(path)
+            return path
+
+        try:
+            with ThreadPoolExecutor(max_workers or self.th.max_workers) as pool:
+                paths = dict(zip(seeds, pool.map(search, seeds)))
+        finally:
+            self.db.add_paths_to_label_graph(new_paths, community, utility_type, self.start_date, self.end_date)
+        return paths
+
     def _search_by_utility(self, utility_type: str, seed: str, community: str) -> List[str]:
         """Helper method for finding the core of a community based on utility type."""
         # Load community consumption map from database into LSM
         db_map = self.db.get_label_graph(community, utility_type, self.start_date, self.end_date)
-        ls_map = LocalSearchMap(db_map['map'], community, utility_type, self.start_date, self.end_date)
+        ls_map = self.search_map(db_map['map'], community, utility_type, self.start_date, self.end_date)
+        path, new = self._climb(utility_type, seed, community, ls_map)
+        if new:
+            self.db.add_path_to_label_graph(path, community, utility_type, self.start_date, self.end_date)
+        return path
+
+    def _climb(self, utility_type: str, seed: str, community: str, ls_map: LocalSearchMap,
+               local_maxes: Dict[str, Future] = None, lock: threading.Lock = None) -> Tuple[List[str], bool]:
+        """Helper method that climbs from the seed to a local max and returns the full path to the core, and whether
+        any of the path is not in 'ls_map' yet. If the climb runs into a cycle, it stops there and the smallest screen
+        name in the cycle is the core. 'local_maxes' memoizes the future local max of every node visited, and is only
+        changed while holding 'lock', so concurrent climbs resolve every node once.
+        """
+        if local_maxes is None:
+            local_maxes = {}
+        if lock is None:
+            lock = threading.Lock()
+
+        def local_max_of(user: str) -> str:
+            with lock:
+                future = local_maxes.get(user)
+                owner = future is None
+                if owner:
+                    future = local_maxes[user] = Future()
+            if owner:
+                try:
+                    future.set_result(self.get_max_utility(utility_type, self.local_nbhd(user, community)))
+                except Exception as e:
+                    future.set_exception(e)
+            return future.result()
+
         path_taken = [seed]
+        visited = {seed}
         curr = seed
 
         # Full path is in db.
         if ls_map.contains_node(curr):
-            return ls_map.generate_path_from(curr)
-        local = self.local_nbhd(curr, community)
-        local_max = self.get_max_utility(utility_type, local)
+            return ls_map.generate_path_from(curr), False
+        local_max = local_max_of(curr)
 
         while curr != local_max:
-            # Add node to path
             print('Local Max of', curr, ':', local_max)
+            if local_max in visited:
+                # Local maxes that point at each other. The smallest screen name in the cycle is its core, so every
+                # climb into the cycle ends at the same node.
+                cycle = path_taken[path_taken.index(local_max):]
+                core = min(cycle)
+                print('Cycle of local maxes', cycle, 'with core', core)
+                return path_taken[:path_taken.index(core) + 1], True
+            # Add node to path
             path_taken.append(local_max)
+            visited.add(local_max)
             curr = local_max
             # Part of the path is in db.
             if ls_map.contains_node(curr):
-                self.db.add_path_to_label_graph(path_taken, community, utility_type, self.start_date, self.end_date)
-                return path_taken[:-1] + ls_map.generate_path_from(curr)
-            local = self.local_nbhd(curr, community)
-            local_max = self.get_max_utility(utility_type, local)
+                return path_taken[:-1] + ls_map.generate_path_from(curr), True
+            local_max = local_max_of(curr)
 
         # No part of the path is in db.
-        self.db.add_path_to_label_graph(path_taken, community, utility_type, self.start_date, self.end_date)
-        return path_taken
+        return path_taken, True
 
     def get_max_utility(self, util_type: str, local: List[str]) -> str:
         """Return the agent with highest utility of 'util_type' in the given local neighborhood."""
@@ -76,38 +147,29 @@ class Ranking:
             assert util_type == 'production'
             return self.get_max_production(local)
 
+    def retweet_matrix(self, local: List[str]) -> RetweetMatrix:
+        """Return the sparse retweet matrix of the given local neighbourhood."""
+        timelines = self.db.get_tweets_many(local, self.start_date, self.end_date)
+        return RetweetMatrix(local, {user: timeline[0] for user, timeline in timelines.items()})
+
     def get_max_consumption(self, local: List[str]) -> str:
         """Helper function that returns the agent with highest consumption utility in the given local neighborhood.
         In the case of a tie, the user that was checked first is chosen.
         """
-        highest_consumer = ''
-        highest_consumption = -1
-
-        for user in local:
-            retweets, _ = self.db.get_tweets(user, self.start_date, self.end_date)
-            score = self.consumption_score(user, retweets, local)
-            # TODO ditto
-            # print("just checked user", user, "score", score)
-            # what if there is a tie? its fine cuz we have [agent] + local
-            if score > highest_consumption:
-                highest_consumer = user
-                highest_consumption = score
-
-        return highest_consumer
+        matrix = self.retweet_matrix(local)
+        return matrix.best(matrix.consumption_scores())
 
     def get_n_consumption(self, local, n):
-        scores = OrderedDict.fromkeys(local, 0)
-        for user in local:
-            retweets, _ = self.db.get_tweets(user, self.start_date, self.end_date)
-            score = self.consumption_score(user, retweets, local)
-            scores[user] = score
-        print(scores)
-        return sorted(scores, key=scores.get, reverse=True)[:n]
+        matrix = self.retweet_matrix(local)
+        scores = matrix.consumption_scores()
+        print(matrix.as_dict(scores))
+        return matrix.top(scores, n)
 
     def consumption_score(self, user: str, retweets: List[Tuple[str, str]], local: List[str]) -> int:
         """Helper function to consumption ranking function. Gives the consumption utility score of 'user' by their
         retweets and local neighborhood.
         """
+        local = set(local)
         score = 0
         for retweet in retweets:
             if retweet[1] != user and retweet[1] in local:
@@ -117,27 +179,20 @@ class Ranking:
 
     def get_max_production(self, local: List[str]) -> str:
         """Helper function that returns the user with highest production utility in the given local neighborhood."""
-        # OrderedDict ensures the 'agent' of local nbhd is priotized in the case of a tie.
-        scores = self.get_production_scores(local)
-        # print(score)
-        return max(scores, key=scores.get)
+        # Ties go to the first user, so the 'agent' of local nbhd is priotized.
+        matrix = self.retweet_matrix(local)
+        return matrix.best(matrix.production_scores())
 
     def get_n_production(self, local: List[str], n) -> List[str]:
         """Helper function that returns the user with highest production utility in the given local neighborhood."""
-        # OrderedDict ensures the 'agent' of local nbhd is priotized in the case of a tie.
-        scores = self.get_production_scores(local)
-        print(scores)
-        return sorted(scores, key=scores.get, reverse=True)[:n]
+        matrix = self.retweet_matrix(local)
+        scores = matrix.production_scores()
+        print(matrix.as_dict(scores))
+        return matrix.top(scores, n)
 
     def get_production_scores(self, local):
-        score = OrderedDict.fromkeys(local, 0)
-        for user in local:
-            retweets, _ = self.db.get_tweets(user, self.start_date, self.end_date)
-            for retweet in retweets:
-                if retweet[1] != user and retweet[1] in local:
-                    score[retweet[1]] += 1
-                    # print(retweet, '\nog:', retweet[1], 'rtwer:', user)
-        return score
+        matrix = self.retweet_matrix(local)
+        return matrix.as_dict(matrix.production_scores())
 
     def get_corpus(self, local):
         corpus = []
@@ -1,59 +1,211 @@
-import json
-import re
-import nltk
+import multiprocessing
+import time
+from collections import Counter
+from bloom import DailyBloomFilters
 from database_handler import DatabaseHandler
-from typing import List
+from dump_reader import parse_status, read_dump, read_lines, read_lines_at, split_dumps
+from util import BatchCount
+from text_processing import process_text
+from datetime import datetime
+from time_buckets import bucket_start
+from typing import List, Optional, Tuple, Dict, Iterable
+
+
+class CountBuffer:
+    """In-memory word counts waiting to be added to the global count, kept per hour bucket of the tweets' creation
+    time. The buffer is flushed to the database as one bulk update once it holds 'max_tweets' tweets, 'max_words'
+    distinct words over all buckets, or is older than 'max_seconds'. 'max_words' is the memory ceiling of the buffer.
+    If 'seen' is given, the filter of counted status ids is saved right after every flush, so it never gets ahead of
+    the global count.
+    """
+
+    def __init__(self, db: DatabaseHandler, max_tweets: int = 10000, max_seconds: float = 60.0,
+                 max_words: int = 200000, seen: DailyBloomFilters = None) -> None:
+        """Creates a new, empty CountBuffer."""
+        self.db = db
+        self.seen = seen
+        self.max_tweets = max_tweets
+        self.max_seconds = max_seconds
+        self.max_words = max_words
+        self.buckets = {}
+        self.words = 0
+        self.tweets = 0
+        self.last_flush = time.monotonic()
+
+    def _bucket(self, hour: Optional[datetime]) -> BatchCount:
+        """Return the counts of the hour starting at 'hour', None being the bucket of tweets without a time."""
+        if hour not in self.buckets:
+            self.buckets[hour] = BatchCount(Counter())
+        return self.buckets[hour]
+
+    def add(self, words: List[str], created_at: datetime = None) -> None:
+        """Count the words of one tweet, flushing if any limit of the buffer is reached."""
+        batch = self._bucket(None if created_at is None else bucket_start(created_at, 'hour'))
+        distinct = len(batch.counter)
+        batch.add_words(words)
+        self.words += len(batch.counter) - distinct
+        self.tweets += 1
+        if self.tweets >= self.max_tweets or self.words >= self.max_words \
+                or time.monotonic() - self.last_flush >= self.max_seconds:
+            self.flush()
+
+    def add_batch(self, buckets: Dict[Optional[datetime], BatchCount]) -> None:
+        """Merge already counted buckets, flushing if the memory ceiling or the time limit is reached."""
+        for hour, other in buckets.items():
+            batch = self._bucket(hour)
+            distinct = len(batch.counter)
+            batch.update(other)
+            self.words += len(batch.counter) - distinct
+        if self.words >= self.max_words or time.monotonic() - self.last_flush >= self.max_seconds:
+            self.flush()
+
+    def flush(self) -> None:
+        """Add the buffered counts to the global count and empty the buffer."""
+        self.db.add_to_global_counts({hour: batch.counter for hour, batch in self.buckets.items()})
+        if self.seen is not None:
+            self.seen.save()
+        self.buckets = {}
+        self.words = 0
+        self.tweets = 0
+        self.last_flush = time.monotonic()
+
 
 class Process:
-    def __init__(self):
+    def __init__(self, max_tweets: int = 10000, max_seconds: float = 60.0, max_words: int = 200000,
+                 seen: DailyBloomFilters = None):
+        """Creates a new Process. Tweets whose status id is in 'seen' were counted before and are skipped, so
+        processing overlapping dumps again doesn't count any tweet twice.
+        """
         self.filepaths = []
         self.db = DatabaseHandler()
+        self.max_tweets = max_tweets
+        self.max_seconds = max_seconds
+        self.max_words = max_words
+        self.seen = seen
+        self.duplicates = 0
 
     def process_file(self, filespaths: List[str]):
+        """Add the words of every tweet in the files to the global count. Counts are batched in memory and the
+        remaining counts are flushed even if reading the files fails partway through.
+        """
         self.filepaths += filespaths
-        for text in self.read_line():
-            for word in self.process_text(text):
-                self.db.word_to_global_count(word)
+        buffer = CountBuffer(self.db, self.max_tweets, self.max_seconds, self.max_words, self.seen)
+        try:
+            for text, created_at in self.read_line():
+                buffer.add(self.process_text(text), created_at)
+        finally:
+            buffer.flush()
+
+    def process_file_parallel(self, filepaths: List[str], workers: int = None, chunk_bytes: int = 64 * 2 ** 20):
+        """Same as process_file, but the files are split into byte ranges of about 'chunk_bytes' that are tokenized
+        and stemmed by a pool of 'workers' processes. Each worker returns partial BatchCounts and the parent merges
+        them, so the global count ends up identical to the serial path.
+
+        With 'seen', every line is parsed once: the workers also return the id, creation time and offset of
+        every status they counted. The parent takes the ranges in file order as they are done and adds their ids to
+        'seen', so the first occurrence of an id is the one counted, like the serial path does. A range whose
+        statuses were all seen before is dropped, otherwise only the lines of the repeats are read again to take
+        their words out of the partial counts.
+        """
+        self.filepaths += filepaths
+        buffer = CountBuffer(self.db, self.max_tweets, self.max_seconds, self.max_words, self.seen)
+        ranges = split_dumps(filepaths, chunk_bytes)
+        try:
+            with multiprocessing.Pool(workers) as pool:
+                if self.seen is None:
+                    for partial, _, _ in pool.imap_unordered(count_range, ranges):
+                        buffer.add_batch(partial)
+                    return
+                for file_range, (partial, statuses, untracked) in zip(ranges, pool.imap(count_range, ranges)):
+                    repeats = [offset for status_id, created_at, offset in statuses
+                               if not self.seen.add(status_id, created_at)]
+                    self.duplicates += len(repeats)
+                    if repeats and len(repeats) == len(statuses) and not untracked:
+                        continue
+                    if repeats:
+                        lines = zip(repeats, read_lines_at(file_range[0], repeats))
+                        for hour, batch in count_lines(lines)[0].items():
+                            partial[hour].subtract(batch)
+                    buffer.add_batch(partial)
+        finally:
+            buffer.flush()
+
+    def process_archive(self, archive_path: str, start: datetime = None, end: datetime = None):
+        """Same as process_file, but for the statuses created within [start, end) in a Parquet archive written by
+        archive.convert. Only the row groups overlapping the window are read, one at a time. Statuses in 'seen' are
+        skipped, so counting an archive again, or dumps that overlap it, doesn't count any tweet twice.
+        """
+        # pyarrow is only needed for archives.
+        from archive import count_row_groups
+        buffer = CountBuffer(self.db, self.max_tweets, self.max_seconds, self.max_words, self.seen)
+        try:
+            for partial in count_row_groups(archive_path, start, end, self.seen):
+                buffer.add_batch(partial)
+        finally:
+            buffer.flush()
 
     def read_line(self):
         for filepath in self.filepaths:
-            file = open(filepath, "r")
-            for line in file:
-                try:
-                    tweet = json.loads(line)
-                    if 'extended_tweet' in tweet:
-                        text = tweet['extended_tweet']['full_text']
-                    elif 'retweeted_status' in tweet:
-                        text = tweet['retweeted_status']['text']
-                    else:
-                        text = tweet['text']
-                except json.decoder.JSONDecodeError:
-                    continue
-                except TypeError:
+            for status in read_dump(filepath):
+                if self.seen is not None and status.id is not None and not self.seen.add(status.id, status.created_at):
+                    self.duplicates += 1
                     continue
-                yield text
+                yield status.text, status.created_at
 
     def save_to_db(self, list_words: List[str]):
-        for word in list_words:
-            self.db.word_to_global_count(word)
-
+        self.db.add_to_global_count(Counter(list_words))
 
     def process_text(self, text: str) -> List[str]:
-        text = re.sub(r"\bhttps:\S*\b", "", text)
-        text = re.sub(r"\b\d*\b", "", text)
-        # @ for handles? [^\w\s@]
-        text = re.sub(r"[^\w\s@]", "", text)
-        text = text.lower()
-        text = text.split()
-        sno = nltk.stem.SnowballStemmer('english')
-        return [sno.stem(x) for x in text]
+        return process_text(text)
+
+
+def count_lines(lines: Iterable[Tuple[int, bytes]]) \
+        -> Tuple[Dict[Optional[datetime], BatchCount], List[Tuple[int, Optional[datetime], int]], int]:
+    """Return the word counts per hour bucket of the statuses on the given (byte offset, line) pairs, the id, creation
+    time and offset of every status counted with an id, and the number of statuses counted without one.
+    """
+    buckets = {}
+    statuses = []
+    untracked = 0
+    for offset, line in lines:
+        status = parse_status(line)
+        if status is None:
+            continue
+        if status.id is not None:
+            statuses.append((status.id, status.created_at, offset))
+        else:
+            untracked += 1
+        hour = None if status.created_at is None else bucket_start(status.created_at, 'hour')
+        if hour not in buckets:
+            buckets[hour] = BatchCount(Counter())
+        buckets[hour].add_words(process_text(status.text))
+    return buckets, statuses, untracked
+
+
+def count_range(file_range: Tuple[str, int, int]) \
+        -> Tuple[Dict[Optional[datetime], BatchCount], List[Tuple[int, Optional[datetime], int]], int]:
+    """Return count_lines of one (filepath, start, end) byte range of a dump. Runs in the worker processes."""
+    return count_lines(read_lines(*file_range))
+
 
 if __name__ == '__main__':
-    import sys
-    p = Process()
+    import argparse
+    parser = argparse.ArgumentParser(description='Add the words of tweet dumps to the global word count.')
+    parser.add_argument('filepaths', nargs='+')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of worker processes, 0 for one per core')
+    parser.add_argument('--seen', default='seen_statuses',
+                        help='directory of the ids of the statuses already counted, one file per day, kept up to date')
+    parser.add_argument('--capacity', type=int, default=10 ** 7,
+                        help='number of status ids a day of seen ids is sized for')
+    args = parser.parse_args()
 
-    filepath = sys.argv[1:]
-    p.process_file(filepath)
+    p = Process(seen=DailyBloomFilters(args.seen, args.capacity))
+    if args.workers == 1:
+        p.process_file(args.filepaths)
+    else:
+        p.process_file_parallel(args.filepaths, args.workers or None)
+    print(p.duplicates, 'duplicate tweets skipped')
 # if __name__ == "__main__":
 #     p = Process()
 #     # print(p)
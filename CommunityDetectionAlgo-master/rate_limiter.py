@@ -0,0 +1,60 @@
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Twitter API rate limits are counted over 15 minute windows.
+WINDOW = 15 * 60
+
+
+class RateLimiter:
+    """Thread-safe tracker of the remaining Twitter API calls per endpoint, e.g. '/statuses/user_timeline'.
+    Every API call acquires one call from its endpoint first; once an endpoint's window is used up, callers wait
+    until it resets instead of being answered with a 429.
+    """
+
+    def __init__(self, refresh: Optional[Callable[[], Dict]] = None) -> None:
+        """Creates a new RateLimiter. 'refresh' returns the API's rate_limit_status and is called lazily before the
+        first call is acquired.
+        """
+        self.refresh = refresh
+        self._quotas = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded = False
+
+    def update(self, rate_data: Dict) -> None:
+        """Update the remaining calls of every endpoint from the result of rate_limit_status."""
+        with self._lock:
+            for res in rate_data['resources'].keys():
+                for func, data in rate_data['resources'][res].items():
+                    self._quotas[func] = [data['remaining'], data['limit'], data['reset']]
+            self._loaded = True
+
+    def remaining(self, endpoint: str) -> Optional[int]:
+        """Return the number of calls left to 'endpoint' in the current window, or None if it isn't tracked."""
+        with self._lock:
+            quota = self._quotas.get(endpoint)
+            return None if quota is None else quota[0]
+
+    def acquire(self, endpoint: str) -> None:
+        """Take one call to 'endpoint', waiting for the window to reset if there are none left."""
+        if not self._loaded and self.refresh is not None:
+            with self._refresh_lock:
+                if not self._loaded:
+                    self.update(self.refresh())
+        while True:
+            with self._lock:
+                quota = self._quotas.get(endpoint)
+                if quota is None:
+                    # Untracked endpoint, leave it to tweepy's own rate limit handling.
+                    return
+                now = time.time()
+                if quota[2] <= now:
+                    quota[0] = quota[1]
+                    quota[2] = now + WINDOW
+                if quota[0] > 0:
+                    quota[0] -= 1
+                    return
+                wait = quota[2] - now
+            print('rate limit reached for', endpoint, 'waiting', int(wait), 'seconds')
+            time.sleep(wait + 1)
@@ -1,22 +1,23 @@
-import json
-import os
+import sys
+from collections import Counter
 
-from word_freq import WordFreq
-
-print(os.getcwd())
-tweets_data_path = './6_28_1730.txt'
-
-tweets_data = []
-tweets_file = open(tweets_data_path, "r")
-for line in tweets_file:
-    # print(line)
-    # print(type(line))
-    tweet = json.loads(line)
-    tweets_data.append(tweet)
-
-print(len(tweets_data))
-
-w = WordFreq.word_count()
+from bloom import BloomFilter
+from dump_reader import read_dump
+from text_processing import process_text
 
+tweets_data_path = sys.argv[1] if len(sys.argv) > 1 else './6_28_1730.txt'
 
 # make sure to check the data im getitng is not corrupt ie no repetition, english, full doc
+seen = BloomFilter()
+counts = Counter()
+tweets = 0
+duplicates = 0
+for status in read_dump(tweets_data_path):
+    if status.id is not None and not seen.add(status.id):
+        duplicates += 1
+        continue
+    tweets += 1
+    counts.update(process_text(status.text))
+
+print(tweets, 'tweets,', duplicates, 'duplicates')
+print(counts.most_common(50))
@@ -0,0 +1,100 @@
+"""Indexes of the productionFunction and globalData collections and the migration of label graphs to one document per edge."""
+import time
+import pymongo
+from typing import Dict, List
+
+ASCENDING = pymongo.ASCENDING
+DESCENDING = pymongo.DESCENDING
+
+# collection name -> list of (keys, options) of every index the DatabaseHandler queries rely on.
+INDEXES = {
+    'timelines': [([('handle', ASCENDING)], {}),
+                  ([('handle_lower', ASCENDING)], {}),
+                  ([('id', ASCENDING)], {'unique': True})],
+    'users': [([('handle', ASCENDING), ('start', ASCENDING), ('end', ASCENDING)], {}),
+              ([('id', ASCENDING), ('start', ASCENDING), ('end', ASCENDING)], {})],
+    'statuses': [([('user_id', ASCENDING), ('created_at', DESCENDING)], {})],
+    'deadAccounts': [([('expires_at', ASCENDING)], {'expireAfterSeconds': 0})],
+    'screenNames': [([('lower', ASCENDING)], {})],
+    'missingUsers': [([('expires_at', ASCENDING)], {'expireAfterSeconds': 0})],
+    'keywords': [([('name', ASCENDING)], {})],
+    'labelGraphEdges': [([('community', ASCENDING), ('ranking_type', ASCENDING), ('start', ASCENDING),
+                          ('end', ASCENDING), ('node', ASCENDING)], {'unique': True})],
+}
+
+GLOBAL_INDEXES = {
+    'wordBuckets': [([('granularity', ASCENDING), ('start', ASCENDING), ('shard', ASCENDING)], {'unique': True})],
+}
+
+# (database, collection, index name) of indexes that were replaced and block their replacement.
+DROPPED_INDEXES = [('globalData', 'wordBuckets', 'granularity_1_start_1')]
+
+
+def ensure_indexes(client: pymongo.MongoClient) -> None:
+    """Create every index in INDEXES and GLOBAL_INDEXES that doesn't exist yet. Run once per deployment, e.g. by
+    running this module, rather than on every connection.
+    """
+    for db_name, collection, name in DROPPED_INDEXES:
+        if name in client[db_name][collection].index_information():
+            client[db_name][collection].drop_index(name)
+    for db_name, db_indexes in [('productionFunction', INDEXES), ('globalData', GLOBAL_INDEXES)]:
+        for collection, indexes in db_indexes.items():
+            for keys, options in indexes:
+                client[db_name][collection].create_index(keys, background=True, **options)
+
+
+def migrate_label_graphs(client: pymongo.MongoClient) -> int:
+    """Copy the 'map' of every label graph document into labelGraphEdges, one document per node, and return the
+    number of edges copied. The original documents are left untouched.
+    """
+    db = client['productionFunction']
+    edges = 0
+    for graph in db['labelGraphs'].find({'map': {'$exists': True}}):
+        start, end = graph['timeframe']
+        requests = [pymongo.UpdateOne({'community': graph['community'], 'ranking_type': graph['ranking_type'],
+                                       'start': start, 'end': end, 'node': node},
+                                      {'$set': {'parent': parent}}, upsert=True)
+                    for node, parent in graph['map'].items()]
+        if requests:
+            db['labelGraphEdges'].bulk_write(requests, ordered=False)
+        edges += len(requests)
+    return edges
+
+
+def explain_query(collection: pymongo.collection.Collection, query: Dict) -> Dict:
+    """Return how MongoDB answers 'query': the stages of the winning plan (IXSCAN rather than COLLSCAN means an
+    index was used), the keys and documents examined and the execution time in milliseconds.
+    """
+    started = time.perf_counter()
+    explain = collection.find(query).explain()
+    elapsed = (time.perf_counter() - started) * 1000
+    stats = explain.get('executionStats', {})
+    return {'stages': _plan_stages(explain['queryPlanner']['winningPlan']),
+            'keys_examined': stats.get('totalKeysExamined'),
+            'docs_examined': stats.get('totalDocsExamined'),
+            'execution_millis': stats.get('executionTimeMillis'),
+            'round_trip_millis': elapsed}
+
+
+def _plan_stages(plan: Dict) -> List[str]:
+    """Return the stages of a query plan from the outermost stage inwards."""
+    stages = [plan['stage']]
+    while 'inputStage' in plan:
+        plan = plan['inputStage']
+        stages.append(plan['stage'])
+    return stages
+
+
+if __name__ == '__main__':
+    import connections
+    from datetime import datetime
+    client = connections.get_client()
+    ensure_indexes(client)
+    print('migrated', migrate_label_graphs(client), 'label graph edges')
+    db = client['productionFunction']
+    print(explain_query(db['timelines'], {"$or": [{"handle": 'hardmaru'}, {"id": 'hardmaru'}]}))
+    print(explain_query(db['statuses'], {'user_id': 1, 'created_at': {'$gte': datetime(2019, 3, 1),
+                                                                      '$lt': datetime(2019, 5, 1)}}))
+    print(explain_query(db['keywords'], {'name': 'machine learning'}))
+    print(explain_query(db['labelGraphEdges'], {'community': 'machine learning', 'ranking_type': 'production',
+                                                'start': datetime(2019, 3, 1), 'end': datetime(2019, 5, 1)}))
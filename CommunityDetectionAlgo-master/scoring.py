@@ -0,0 +1,52 @@
+import numpy as np
+import scipy.sparse
+from collections import OrderedDict
+from typing import List, Tuple, Dict
+
+
+class RetweetMatrix:
+    """Sparse retweeter x author adjacency matrix of a local neighbourhood. Entry (i, j) is the number of times
+    user i retweeted user j, counting only authors within the neighbourhood and ignoring self retweets.
+    Production utility is then a column sum and consumption utility a row sum.
+    """
+
+    def __init__(self, local: List[str], retweets: Dict[str, List[Tuple[str, str]]]) -> None:
+        """Creates a new RetweetMatrix from the retweets of every user in 'local'."""
+        self.users = list(OrderedDict.fromkeys(local))
+        self.index = {user: i for i, user in enumerate(self.users)}
+        rows = []
+        cols = []
+        for i, user in enumerate(self.users):
+            for retweet in retweets.get(user, []):
+                j = self.index.get(retweet[1])
+                if j is not None and j != i:
+                    rows.append(i)
+                    cols.append(j)
+        n = len(self.users)
+        # Duplicate (row, col) entries are summed by the csr constructor.
+        self.matrix = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n, n))
+
+    def production_scores(self) -> np.ndarray:
+        """Return the production utility of every user, i.e. how often they were retweeted in the neighbourhood."""
+        return np.asarray(self.matrix.sum(axis=0)).ravel()
+
+    def consumption_scores(self) -> np.ndarray:
+        """Return the consumption utility of every user, i.e. how often they retweeted the neighbourhood."""
+        return np.asarray(self.matrix.sum(axis=1)).ravel()
+
+    def as_dict(self, scores: np.ndarray) -> 'OrderedDict[str, int]':
+        """Return the scores keyed by user, in neighbourhood order."""
+        return OrderedDict(zip(self.users, scores.tolist()))
+
+    def top(self, scores: np.ndarray, n: int) -> List[str]:
+        """Return the 'n' users with the highest scores. Ties go to the user that comes first in the
+        neighbourhood.
+        """
+        order = np.argsort(-scores, kind='stable')[:n]
+        return [self.users[i] for i in order]
+
+    def best(self, scores: np.ndarray) -> str:
+        """Return the user with the highest score, the first one in the neighbourhood in the case of a tie."""
+        if len(self.users) == 0:
+            return ''
+        return self.users[int(np.argmax(scores))]
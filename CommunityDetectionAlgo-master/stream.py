@@ -1,41 +1,148 @@
 import tweepy
-import keys
+import connections
 import pymongo
-import ssl
+import threading
+from queue import Queue, Empty, Full
+from database_handler import DatabaseHandler
+from bloom import DailyBloomFilters
+from dump_reader import parse_status
+from process import CountBuffer
+from text_processing import process_text
 
 
 class MyStreamListener(tweepy.StreamListener):
-    def __init__(self):
+    def __init__(self, queue: Queue = None, client: pymongo.MongoClient = None, consumer: threading.Thread = None,
+                 put_timeout: float = 60.0):
+        """Creates a new MyStreamListener that puts the raw data of every status on 'queue'. The queue is bounded,
+        so the stream is held back when the consumer falls behind, for at most 'put_timeout' seconds.
+        """
         super().__init__()
+        self.queue = queue if queue is not None else Queue(maxsize=10000)
+        self.client = client
+        self.consumer = consumer
+        self.put_timeout = put_timeout
         self.statuses = []
         self.counter = 0
-        self.save_file = open('tweets.json', 'w')
-
 
     def on_data(self, data):
-        print(data)
+        """Queue the raw data of a status. Raises a RuntimeError, which disconnects the stream, if the consumer died
+        or didn't take anything off the full queue for 'put_timeout' seconds.
+        """
+        if self.consumer is not None and not self.consumer.is_alive():
+            raise RuntimeError('The consumer of the stream queue is not running')
+        try:
+            self.queue.put(data, timeout=self.put_timeout)
+        except Full:
+            raise RuntimeError(f'The stream queue was full for {self.put_timeout} seconds')
 
     def save_to_db(self, status):
-        client = pymongo.MongoClient(keys.mongo_key, ssl=True, ssl_cert_reqs=ssl.CERT_NONE)
+        if self.client is None:
+            self.client = connections.get_client()
         if 'retweeted_status' in status._json:
-            text = status._json['retweeted_status']['doc']
+            text = status._json['retweeted_status']['text']
         else:
             try:
                 text = status._json['extended_tweet']['full_text']
             except KeyError:
-                text = status._json['doc']
-        col = client['globalTweets']['randomStream']
+                text = status._json['text']
+        col = self.client['globalTweets']['randomStream']
         col.insert_one({'doc': text})
 
+
+class StreamCounter(threading.Thread):
+    """Consumer of a MyStreamListener's queue. Statuses are parsed, normalized and counted in micro-batches that are
+    added to the global count as one update per batch. Statuses already in 'seen', e.g. re-sent after a reconnect, are
+    skipped.
+    """
+
+    def __init__(self, queue: Queue, db: DatabaseHandler, max_tweets: int = 1000, max_seconds: float = 10.0,
+                 max_words: int = 200000, seen: DailyBloomFilters = None) -> None:
+        """Creates a new StreamCounter, flushing every 'max_tweets' tweets or 'max_seconds' seconds."""
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.max_seconds = max_seconds
+        self.seen = seen
+        self.buffer = CountBuffer(db, max_tweets, max_seconds, max_words, seen)
+
+    def run(self) -> None:
+        """Count the queued statuses until stopped. An error in one status or flush is printed and the queue keeps
+        being drained, a batch that failed to flush stays buffered and is retried with the next flush.
+        """
+        try:
+            while True:
+                try:
+                    data = self.queue.get(timeout=self.max_seconds)
+                except Empty:
+                    # The stream went quiet, don't hold on to a partial batch.
+                    self._flush()
+                    continue
+                if data is None:
+                    break
+                try:
+                    self._count(data)
+                except Exception as e:
+                    print('Error while counting a status:', repr(e))
+        finally:
+            self._flush()
+
+    def _count(self, data) -> None:
+        """Count the raw data of one status, unless it was seen before."""
+        status = parse_status(data)
+        if status is None:
+            return
+        if self.seen is not None and status.id is not None and not self.seen.add(status.id, status.created_at):
+            return
+        self.buffer.add(process_text(status.text), status.created_at)
+
+    def _flush(self) -> None:
+        try:
+            self.buffer.flush()
+        except Exception as e:
+            print('Failed to flush', self.buffer.tweets, 'tweets:', repr(e))
+
+    def stop(self, timeout: float = 60.0) -> None:
+        """Stop once every status already queued is counted, and wait for the last flush. Raises a RuntimeError if the
+        consumer isn't running or the queue stays full for 'timeout' seconds.
+        """
+        if not self.is_alive():
+            raise RuntimeError('StreamCounter is not running')
+        try:
+            self.queue.put(None, timeout=timeout)
+        except Full:
+            raise RuntimeError(f'The stream queue was full for {timeout} seconds')
+        self.join()
+
+
+def replay(filepath: str, listener: MyStreamListener) -> int:
+    """Feed the lines of a JSONL dump to 'listener' as if they came from the stream, and return how many were fed."""
+    fed = 0
+    with open(filepath, "r") as file:
+        for line in file:
+            listener.on_data(line)
+            fed += 1
+    return fed
+
+
 class MyStream():
     def __init__(self) -> None:
         """Creates a new myStream."""
-        auth = tweepy.OAuthHandler(keys.consumer_key, keys.consumer_secret_key)
-        auth.set_access_token(keys.access_token, keys.access_token_secret)
-        api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
-        my_stream_listener = MyStreamListener()
-        self.stream = tweepy.Stream(auth=api.auth, listener=my_stream_listener)
+        api = connections.get_api()
+        db = DatabaseHandler()
+        queue = Queue(maxsize=10000)
+        self.counter = StreamCounter(queue, db, seen=DailyBloomFilters('seen_statuses'))
+        self.listener = MyStreamListener(queue, client=db.client, consumer=self.counter)
+        self.stream = tweepy.Stream(auth=api.auth, listener=self.listener)
+
 
 if __name__ == "__main__":
+    import sys
     my_stream = MyStream()
-    my_stream.stream.sample(languages=["en"])
+    my_stream.counter.start()
+    try:
+        if len(sys.argv) > 1:
+            for filepath in sys.argv[1:]:
+                print(filepath, replay(filepath, my_stream.listener))
+        else:
+            my_stream.stream.sample(languages=["en"])
+    finally:
+        my_stream.counter.stop()
@@ -0,0 +1,96 @@
+import numpy as np
+import scipy.sparse
+from collections import Counter
+from typing import Dict, List, Iterable
+
+
+class TermMatrix:
+    """Sparse CSR user x term matrix of word counts over a fixed vocabulary. Row i belongs to users[i] and column j
+    to vocabulary[j], so whole neighbourhood statistics are computed with array operations instead of Counters.
+    """
+
+    def __init__(self, users: List[str], vocabulary: List[str], matrix: scipy.sparse.csr_matrix) -> None:
+        """Creates a new TermMatrix."""
+        self.users = users
+        self.vocabulary = vocabulary
+        self.index = {term: j for j, term in enumerate(vocabulary)}
+        self.matrix = matrix
+
+    @classmethod
+    def from_counts(cls, user_counts: Dict[str, Counter], vocabulary: List[str] = None) -> 'TermMatrix':
+        """Return the TermMatrix of the word count of every user. Without a vocabulary, every word used is a term;
+        otherwise words outside of the vocabulary are dropped.
+        """
+        if vocabulary is None:
+            index = {}
+            for counter in user_counts.values():
+                for word in counter:
+                    if word not in index:
+                        index[word] = len(index)
+            vocabulary = list(index)
+        else:
+            index = {term: j for j, term in enumerate(vocabulary)}
+        indptr = [0]
+        indices = []
+        data = []
+        for counter in user_counts.values():
+            for word, count in counter.items():
+                j = index.get(word)
+                if j is not None:
+                    indices.append(j)
+                    data.append(count)
+            indptr.append(len(indices))
+        matrix = scipy.sparse.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64),
+                                          np.array(indptr, dtype=np.int64)),
+                                         shape=(len(user_counts), len(vocabulary)))
+        return cls(list(user_counts), vocabulary, matrix)
+
+    def totals(self) -> np.ndarray:
+        """Return the count of every term over all users."""
+        return np.asarray(self.matrix.sum(axis=0)).ravel()
+
+    def user_totals(self) -> np.ndarray:
+        """Return the number of words of every user."""
+        return np.asarray(self.matrix.sum(axis=1)).ravel()
+
+    def document_frequency(self) -> np.ndarray:
+        """Return the number of users that used every term."""
+        return np.bincount(self.matrix.indices, minlength=len(self.vocabulary))
+
+    def align(self, counter: Counter) -> np.ndarray:
+        """Return the counts of 'counter' as a vector over the vocabulary, 0 for terms it doesn't have."""
+        return np.fromiter((counter.get(term, 0) for term in self.vocabulary), dtype=np.float64,
+                           count=len(self.vocabulary))
+
+    def mask(self, terms: Iterable[str]) -> np.ndarray:
+        """Return the boolean vector over the vocabulary of the given terms."""
+        mask = np.zeros(len(self.vocabulary), dtype=bool)
+        mask[[self.index[term] for term in terms if term in self.index]] = True
+        return mask
+
+    def select(self, keep: np.ndarray) -> 'TermMatrix':
+        """Return the TermMatrix of the terms where the boolean vector 'keep' is True."""
+        columns = np.flatnonzero(keep)
+        return TermMatrix(self.users, [self.vocabulary[j] for j in columns], self.matrix[:, columns].tocsr())
+
+    def divide(self, denominators: np.ndarray) -> 'TermMatrix':
+        """Return the TermMatrix with every column divided by its denominator, 0 where the denominator is 0."""
+        inverse = np.divide(1.0, denominators, out=np.zeros(len(denominators)), where=denominators != 0)
+        return TermMatrix(self.users, self.vocabulary, self.matrix.multiply(inverse).tocsr())
+
+    def row(self, user: str) -> Counter:
+        """Return the non-zero values of a user's row as a Counter."""
+        i = self.users.index(user)
+        start, end = self.matrix.indptr[i], self.matrix.indptr[i + 1]
+        return Counter({self.vocabulary[j]: value
+                        for j, value in zip(self.matrix.indices[start:end], self.matrix.data[start:end])})
+
+    def top_terms(self, n: int) -> Dict[str, List[str]]:
+        """Return the 'n' terms with the highest values of every user."""
+        top = {}
+        for i, user in enumerate(self.users):
+            start, end = self.matrix.indptr[i], self.matrix.indptr[i + 1]
+            values = self.matrix.data[start:end]
+            order = np.argsort(-values, kind='stable')[:n]
+            top[user] = [self.vocabulary[j] for j in self.matrix.indices[start:end][order]]
+        return top
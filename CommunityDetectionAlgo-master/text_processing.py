@@ -0,0 +1,46 @@
+"""Text normalization shared by the global count ingestion and the user timeline word counts."""
+import re
+import nltk
+from collections import Counter
+from functools import lru_cache
+from typing import List
+
+URL_RE = re.compile(r"\bhttps:\S*\b")
+NUMBER_RE = re.compile(r"\b\d*\b")
+# Handles are kept, so @ is not removed.
+PUNCTUATION_RE = re.compile(r"[^\w\s@]")
+
+stemmer = nltk.stem.SnowballStemmer('english')
+
+
+def clean_text(text: str) -> str:
+    """Return 'text' without links, numbers and punctuation."""
+    text = URL_RE.sub("", text)
+    text = NUMBER_RE.sub("", text)
+    return PUNCTUATION_RE.sub("", text)
+
+
+@lru_cache(maxsize=2 ** 18)
+def stem(word: str) -> str:
+    """Return the Snowball stem of 'word'. Twitter vocabulary is heavily skewed, so most calls are cache hits."""
+    return stemmer.stem(word)
+
+
+def stem_words(text: str) -> List[str]:
+    """Return the stems of every word of already cleaned text."""
+    return [stem(word) for word in text.lower().split()]
+
+
+def process_text(text: str) -> List[str]:
+    """Return the stems of every word of raw tweet text."""
+    return stem_words(clean_text(text))
+
+
+def word_count(text: str) -> Counter:
+    """Return the count of stems of already cleaned text."""
+    return Counter(stem_words(text))
+
+
+def stem_cache_info():
+    """Return the hits, misses and size of the stem cache."""
+    return stem.cache_info()
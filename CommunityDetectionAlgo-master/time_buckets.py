@@ -0,0 +1,65 @@
+"""Calendar buckets of the global word count. Counts are stored per hour and rolled up per day, week (starting on
+Monday) and month, so any window can be answered from a handful of buckets. Every bucket is stored as SHARDS documents
+split by a hash of the word, so a month of vocabulary stays far below the document size limit.
+"""
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+# Largest first, the order cover tries them in.
+GRANULARITIES = ['month', 'week', 'day', 'hour']
+SHARDS = 64
+
+
+def shard(word: str) -> int:
+    """Return the shard of a word, the same in every process unlike hash()."""
+    return zlib.crc32(word.encode('utf-8')) % SHARDS
+
+
+def bucket_start(time: datetime, granularity: str) -> datetime:
+    """Return the start of the bucket of 'granularity' that 'time' falls in."""
+    hour = time.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'hour':
+        return hour
+    day = hour.replace(hour=0)
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    raise ValueError('Invalid granularity')
+
+
+def bucket_end(start: datetime, granularity: str) -> datetime:
+    """Return the end of the bucket of 'granularity' starting at 'start'."""
+    if granularity == 'hour':
+        return start + timedelta(hours=1)
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if granularity == 'week':
+        return start + timedelta(weeks=1)
+    if granularity == 'month':
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    raise ValueError('Invalid granularity')
+
+
+def rollups(hour: datetime) -> List[Tuple[str, datetime]]:
+    """Return every bucket, of every granularity, that the hour starting at 'hour' belongs to."""
+    return [(granularity, bucket_start(hour, granularity)) for granularity in GRANULARITIES]
+
+
+def cover(start: datetime, end: datetime) -> List[Tuple[str, datetime]]:
+    """Return the fewest (granularity, bucket start) buckets that exactly tile [start, end), taking the largest
+    bucket that fits at every step. Both ends are rounded down to the hour.
+    """
+    curr = bucket_start(start, 'hour')
+    end = bucket_start(end, 'hour')
+    buckets = []
+    while curr < end:
+        for granularity in GRANULARITIES:
+            if bucket_start(curr, granularity) == curr and bucket_end(curr, granularity) <= end:
+                buckets.append((granularity, curr))
+                curr = bucket_end(curr, granularity)
+                break
+    return buckets
@@ -0,0 +1,89 @@
+import atexit
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Tuple, Union, Optional, Hashable
+
+Timeline = Tuple[List[Tuple[str, str]], List[str]]
+
+
+class TimelineCache:
+    """In-process cache of user timelines keyed on (user, start, end). Least recently used timelines are evicted once
+    the cache holds 'max_size' timelines, and timelines older than 'ttl' seconds are treated as missing. If 'path' is
+    given, the cache is loaded from that file on creation and saved back to it on exit.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = None, path: Optional[str] = None) -> None:
+        """Creates a new TimelineCache."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def key(user: Union[str, int], start: datetime, end: datetime) -> Hashable:
+        """Return the cache key of a timeline."""
+        return user, start, end
+
+    def get(self, user: Union[str, int], start: datetime, end: datetime) -> Optional[Timeline]:
+        """Return the cached timeline of 'user' within the timeframe, or None if it isn't cached."""
+        key = self.key(user, start, end)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user: Union[str, int], start: datetime, end: datetime, timeline: Timeline) -> None:
+        """Cache the timeline of 'user' within the timeframe, evicting the least recently used timelines if full."""
+        key = self.key(user, start, end)
+        with self._lock:
+            self._entries[key] = (time.time(), timeline)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        """Return the fraction of lookups that were answered by the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> str:
+        """Return a summary of the cache statistics."""
+        return f'TimelineCache(size={len(self._entries)}, hits={self.hits}, misses={self.misses}, ' \
+               f'hit_rate={self.hit_rate():.2%})'
+
+    def load(self) -> None:
+        """Load the timelines saved at 'path', if any."""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as file:
+            entries = pickle.load(file)
+        with self._lock:
+            self._entries = OrderedDict(list(entries.items())[-self.max_size:])
+
+    def save(self) -> None:
+        """Save the cached timelines to 'path'."""
+        if self.path is None:
+            return
+        with self._lock:
+            entries = OrderedDict(self._entries)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(entries, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
@@ -1,19 +1,51 @@
-import keys
+import connections
 import tweepy
 from datetime import datetime
-from typing import List, Tuple, Union, Generator
-import itertools
+from typing import List, Tuple, Union, Generator, Callable, Any
+from rate_limiter import RateLimiter
 import random
 
+# Twitter error codes of accounts that don't exist (34, 50) or are suspended (63).
+UNAVAILABLE_CODES = {34, 50, 63}
+
+
+def account_unavailable(error: tweepy.error.TweepError) -> bool:
+    """Return True if 'error' means the account is private, suspended or deleted, rather than that the request
+    failed, e.g. a 5xx response or a connection error.
+    """
+    if error.api_code in UNAVAILABLE_CODES:
+        return True
+    return error.response is not None and error.response.status_code in (401, 404)
+
 
 class TweepyHandler:
     """Wrapper class for dealing with the Twitter API using tweepy."""
 
-    def __init__(self) -> None:
-        """Creates a new TweepyHandler."""
-        auth = tweepy.OAuthHandler(keys.consumer_key, keys.consumer_secret_key)
-        auth.set_access_token(keys.access_token, keys.access_token_secret)
-        self.api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
+    def __init__(self, api: tweepy.API = None, max_workers: int = 8) -> None:
+        """Creates a new TweepyHandler on the process-wide API from connections. 'api' can be given to talk to
+        another host, e.g. a local fake API server. Batches of calls, e.g. DatabaseHandler.get_tweets_many,
+        use up to 'max_workers' threads.
+        """
+        if api is None:
+            self.api = connections.get_api()
+            self.limiter = connections.get_rate_limiter()
+        else:
+            self.api = api
+            self.limiter = RateLimiter(api.rate_limit_status)
+        self.max_workers = max_workers
+
+    def _items(self, endpoint: str, method: Callable, **kwargs) -> Generator[Any, None, None]:
+        """Yield the items of every page of a paginated API method, acquiring a call to 'endpoint' before each
+        page is requested.
+        """
+        pages = tweepy.Cursor(method, **kwargs).pages()
+        while True:
+            self.limiter.acquire(endpoint)
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            yield from page
 
     def get_tweets(self, user: Union[int, str], start: datetime, end: datetime) \
             -> Tuple[List[Tuple[str, str]], List[str]]:
@@ -21,7 +53,8 @@ class TweepyHandler:
         within a timeframe.
         User's with private/suspended/deleted accounts will return empty Tweets and Retweets.
         """
-        statuses = tweepy.Cursor(self.api.user_timeline, id=user, tweet_mode='extended', count=200).items()
+        statuses = self._items('/statuses/user_timeline', self.api.user_timeline, id=user, tweet_mode='extended',
+                               count=200)
         retweets = []
         tweets = []
         try:
@@ -42,25 +75,58 @@ class TweepyHandler:
             print('TweepError on ', user)
         return retweets, tweets
 
-    def get_friends(self, user: str) -> Generator[str, None, None]:
-        """Return a list of all the screen names of users that 'user' follows."""
-        # This is where a lot of the rate limting occurs 2 diff implementation for small and big?
-        friends = tweepy.Cursor(self.api.friends_ids, screen_name=user, count=5000).items()
+    def get_statuses(self, user: Union[int, str], since_id: int = None, max_id: int = None, until: datetime = None) \
+            -> Tuple[List[tweepy.models.Status], bool]:
+        """Return the statuses of a user, newest first, that are newer than 'since_id' and not newer than 'max_id'.
+        Paging stops after the first status created before 'until'. The second value returned is True if the
+        timeline ran out before that.
+        TweepError is raised when the user's account is either private, suspended, or deleted.
+        """
+        kwargs = {'id': user, 'tweet_mode': 'extended', 'count': 200}
+        if since_id is not None:
+            kwargs['since_id'] = since_id
+        if max_id is not None:
+            kwargs['max_id'] = max_id
+        statuses = []
+        for status in self._items('/statuses/user_timeline', self.api.user_timeline, **kwargs):
+            statuses.append(status)
+            if until is not None and status.created_at < until:
+                return statuses, False
+        return statuses, True
+
+    def get_friend_ids(self, user: Union[int, str]) -> List[int]:
+        """Return the ids of all the users that 'user' follows."""
+        kwargs = {'user_id': user} if isinstance(user, int) else {'screen_name': user}
+        return list(self._items('/friends/ids', self.api.friends_ids, count=5000, **kwargs))
 
-        def grouper(n, iterator):
-            while True:
-                chunk = list(itertools.islice(iterator, n))
-                if not chunk:
-                    return
-                yield chunk
-        # make this a generator instead of a list
-        for hund_ids in grouper(100, friends):
-            for user in self.api.lookup_users(hund_ids):
-                yield user.screen_name
+    def lookup_users(self, ids: List[int] = None, screen_names: List[str] = None) -> List[tweepy.models.User]:
+        """Return the users with the given ids or screen names, looked up in groups of 100. Users whose accounts
+        no longer exist are left out. Other failures raise TweepError.
+        """
+        groups = [{'user_ids': ids[i:i + 100]} for i in range(0, len(ids or []), 100)] + \
+                 [{'screen_names': screen_names[i:i + 100]} for i in range(0, len(screen_names or []), 100)]
+        users = []
+        for group in groups:
+            self.limiter.acquire('/users/lookup')
+            try:
+                users.extend(self.api.lookup_users(**group))
+            # TweepError is raised when none of the users in the group exist.
+            except tweepy.error.TweepError as e:
+                if not account_unavailable(e):
+                    raise
+        return users
+
+    def get_friends(self, user: Union[int, str]) -> Generator[str, None, None]:
+        """Return a list of all the screen names of users that 'user' follows."""
+        friends = self.get_friend_ids(user)
+        for i in range(0, len(friends), 100):
+            for friend in self.lookup_users(ids=friends[i:i + 100]):
+                yield friend.screen_name
 
     def rate_limit(self) -> None:
         """Print remaining API calls to functions that do not have full API calls."""
         rate_data = self.api.rate_limit_status()
+        self.limiter.update(rate_data)
         for res in rate_data['resources'].keys():
             for func in rate_data['resources'][res].keys():
                 if rate_data['resources'][res][func]['limit'] != rate_data['resources'][res][func]['remaining']:
@@ -1,3 +1,7 @@
+import json
+import threading
+import numpy as np
+from collections import Counter
 from datetime import datetime
 from typing import List, Dict
 
@@ -20,18 +24,237 @@ class LocalSearchMap:
             raise ValueError('Invalid utility type')
         self.start_date = start_date
         self.end_date = end_date
+        self._roots = {}
 
     def generate_path_from(self, start: str) -> List[str]:
-        """Return a list of screen names of users in a path starting from 'start'."""
+        """Return a list of screen names of users in a path starting from 'start'.
+        Raises a ValueError if the path runs into a cycle.
+        """
         path = [start]
+        visited = {start}
         curr = start
         nxt = self.map_dict[start]
         while curr != nxt:
+            if nxt in visited:
+                raise ValueError(f'Cycle in LocalSearchMap through {nxt}')
             path.append(nxt)
+            visited.add(nxt)
             curr = nxt
             nxt = self.map_dict[curr]
         return path
 
+    def root_of(self, user: str) -> str:
+        """Return the root of the tree 'user' belongs to. Roots are cached for every node on the way (path
+        compression), so repeated queries take amortized O(1).
+        Raises a ValueError if the path runs into a cycle.
+        """
+        path = []
+        visited = set()
+        curr = user
+        while curr not in self._roots:
+            nxt = self.map_dict[curr]
+            if nxt == curr:
+                self._roots[curr] = curr
+                break
+            if curr in visited:
+                raise ValueError(f'Cycle in LocalSearchMap through {curr}')
+            visited.add(curr)
+            path.append(curr)
+            curr = nxt
+        root = self._roots[curr]
+        for node in path:
+            self._roots[node] = root
+        return root
+
+    def roots_of(self, users: List[str]) -> Dict[str, str]:
+        """Return the root of every user."""
+        return {user: self.root_of(user) for user in users}
+
+    def community_sizes(self) -> Counter:
+        """Return the number of nodes in the tree of every root, in one pass over the forest."""
+        return Counter(self.root_of(node) for node in self.map_dict)
+
     def contains_node(self, user: str) -> bool:
         """Return True if 'user' is a node in LocalSearchMap, False otherwise."""
         return user in self.map_dict
+
+    def add_path(self, path: List[str]) -> None:
+        """Add a path to LocalSearchMap, its last node being a root. Nodes are added from the root down, so a
+        concurrent reader never sees a node whose ancestors are missing.
+        """
+        moved = False
+        for i in reversed(range(0, len(path))):
+            parent = path[i + 1] if i < len(path) - 1 else path[i]
+            moved = moved or self.map_dict.get(path[i], parent) != parent
+            self.map_dict[path[i]] = parent
+        if moved:
+            # A node changed parents, so the cached roots below it are stale.
+            self._roots.clear()
+
+
+class CompactLocalSearchMap:
+    """Same forest as LocalSearchMap, for multi-million node communities. Screen names are interned to integer ids
+    and the parent of every node is stored in a NumPy int32 array, so a node costs a few bytes instead of a dict
+    entry. The arrays can be saved to a local file and loaded back memory-mapped without copying.
+    """
+    def __init__(self, map_dict: Dict[str, str], community: str, util_type: str, start_date: datetime,
+                 end_date: datetime) -> None:
+        """A CompactLocalSearchMap, built from the same dictionary as a LocalSearchMap."""
+        self.community = community
+        if util_type in ['production', 'consumption']:
+            self.util_type = util_type
+        else:
+            raise ValueError('Invalid utility type')
+        self.start_date = start_date
+        self.end_date = end_date
+        self.names = []
+        self.ids = {}
+        for node, parent in map_dict.items():
+            self._intern(node)
+            self._intern(parent)
+        self.size = len(self.names)
+        self.parents = np.arange(self.size, dtype=np.int32)
+        for node, parent in map_dict.items():
+            self.parents[self.ids[node]] = self.ids[parent]
+        self._roots = None
+        self._lock = threading.Lock()
+
+    def _intern(self, name: str) -> int:
+        """Return the id of 'name', giving it a new id if it doesn't have one."""
+        node_id = self.ids.get(name)
+        if node_id is None:
+            node_id = len(self.names)
+            self.ids[name] = node_id
+            self.names.append(name)
+        return node_id
+
+    @property
+    def map_dict(self) -> Dict[str, str]:
+        """Return the forest as the dictionary of a LocalSearchMap."""
+        return {self.names[i]: self.names[parent] for i, parent in enumerate(self.parents[:self.size].tolist())}
+
+    def generate_path_from(self, start: str) -> List[str]:
+        """Return a list of screen names of users in a path starting from 'start'.
+        Raises a ValueError if the path runs into a cycle.
+        """
+        with self._lock:
+            curr = self.ids[start]
+            path = [curr]
+            nxt = int(self.parents[curr])
+            while curr != nxt:
+                if len(path) > self.size:
+                    raise ValueError(f'Cycle in LocalSearchMap through {start}')
+                path.append(nxt)
+                curr = nxt
+                nxt = int(self.parents[curr])
+            return [self.names[node] for node in path]
+
+    def _root_ids(self) -> np.ndarray:
+        """Return the root id of every node, by pointer jumping over the whole parent array at once. The result is
+        cached until the forest changes.
+        """
+        with self._lock:
+            if self._roots is None:
+                roots = np.array(self.parents[:self.size])
+                # Every jump doubles the distance covered, so log2(size) jumps reach the root from any depth.
+                for _ in range(self.size.bit_length() + 1):
+                    nxt = roots[roots]
+                    if np.array_equal(nxt, roots):
+                        break
+                    roots = nxt
+                # Jumping around a cycle can also settle, so check every node landed on a real root.
+                if not np.array_equal(self.parents[:self.size][roots], roots):
+                    raise ValueError('Cycle in LocalSearchMap')
+                self._roots = roots
+            return self._roots
+
+    def root_of(self, user: str) -> str:
+        """Return the root of the tree 'user' belongs to."""
+        return self.names[self._root_ids()[self.ids[user]]]
+
+    def roots_of(self, users: List[str]) -> Dict[str, str]:
+        """Return the root of every user."""
+        roots = self._root_ids()[[self.ids[user] for user in users]]
+        return {user: self.names[root] for user, root in zip(users, roots.tolist())}
+
+    def community_sizes(self) -> Counter:
+        """Return the number of nodes in the tree of every root."""
+        sizes = np.bincount(self._root_ids(), minlength=self.size)
+        return Counter({self.names[root]: int(sizes[root]) for root in np.flatnonzero(sizes).tolist()})
+
+    def contains_node(self, user: str) -> bool:
+        """Return True if 'user' is a node in CompactLocalSearchMap, False otherwise."""
+        return user in self.ids
+
+    def add_path(self, path: List[str]) -> None:
+        """Add a path to CompactLocalSearchMap, its last node being a root."""
+        with self._lock:
+            ids = [self._intern(node) for node in path]
+            if len(self.names) > len(self.parents) or not self.parents.flags.writeable:
+                # Grow geometrically, this also copies a read-only memory-mapped array.
+                parents = np.empty(max(2 * len(self.parents), len(self.names)), dtype=np.int32)
+                parents[:self.size] = self.parents[:self.size]
+                self.parents = parents
+            self.parents[self.size:len(self.names)] = np.arange(self.size, len(self.names), dtype=np.int32)
+            self.size = len(self.names)
+            for i in range(0, len(ids)):
+                self.parents[ids[i]] = ids[i + 1] if i < len(ids) - 1 else ids[i]
+            self._roots = None
+
+    def save(self, path: str) -> None:
+        """Save the forest to 'path'.npy (the parent array) and 'path'.json (the screen names and metadata)."""
+        np.save(path + '.npy', np.asarray(self.parents[:self.size]))
+        with open(path + '.json', 'w') as file:
+            json.dump({'community': self.community, 'util_type': self.util_type,
+                       'start_date': self.start_date.isoformat(), 'end_date': self.end_date.isoformat(),
+                       'names': self.names}, file)
+
+    @classmethod
+    def load(cls, path: str) -> 'CompactLocalSearchMap':
+        """Load a forest saved with save. The parent array is memory-mapped rather than read into memory."""
+        with open(path + '.json') as file:
+            meta = json.load(file)
+        ls_map = cls({}, meta['community'], meta['util_type'], datetime.fromisoformat(meta['start_date']),
+                     datetime.fromisoformat(meta['end_date']))
+        ls_map.names = meta['names']
+        ls_map.ids = {name: i for i, name in enumerate(ls_map.names)}
+        ls_map.parents = np.load(path + '.npy', mmap_mode='r')
+        ls_map.size = len(ls_map.names)
+        return ls_map
+
+
+class BatchCount:
+
+    def __init__(self, counter: Counter, total: int=None) -> None:
+        self.counter = counter
+        self.total = total if total else sum(counter.values())
+
+    def __add__(self, other: 'BatchCount') -> 'BatchCount':
+        """Return added"""
+        return BatchCount(self.counter + other.counter, self.total + other.total)
+
+    def __str__(self):
+        return f'BatchCount(\nCounter:{self.counter}\nTotal:{self.total})'
+
+    def update(self, other: 'BatchCount') -> None:
+        """Modify by adding"""
+        self.counter.update(other.counter)
+        self.total += other.total
+
+    def subtract(self, other: 'BatchCount') -> None:
+        """Modify by subtracting counts that are part of this one, e.g. those of tweets counted twice."""
+        self.counter.subtract(other.counter)
+        self.counter = +self.counter
+        self.total -= other.total
+
+    def add_words(self, words: List[str]) -> None:
+        """Modify by counting every word in 'words'."""
+        self.counter.update(words)
+        self.total += len(words)
+
+    def remove_word(self, word: str) -> None:
+        try:
+            self.total -= self.counter[word]
+            del self.counter[word]
+        except KeyError:
+            print(f'{word} not in BatchCount')
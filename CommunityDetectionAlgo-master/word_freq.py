@@ -1,43 +1,56 @@
-from collections import Counter
-import pandas as pd
+from collections import Counter, OrderedDict
 import nltk
 from local_search import *
 import numpy as np
 from wordfreq import word_frequency
 import copy
-
-
-class BatchCount:
-
-    def __init__(self, counter: Counter, total: int=None) -> None:
-        self.counter = counter
-        self.total = total if total else sum(counter.values())
-
-    def __add__(self, other: 'BatchCount') -> 'BatchCount':
-        """Return added"""
-        return BatchCount(self.counter + other.counter, self.total + other.total)
-
-    def __str__(self):
-        return f'BatchCount(\nCounter:{self.counter}\nTotal:{self.total})'
-
-    def update(self, other: 'BatchCount') -> None:
-        """Modify by adding"""
-        self.counter.update(other.counter)
-        self.total += other.total
-
-    def remove_word(self, word: str) -> None:
-        try:
-            self.total -= self.counter[word]
-            del self.counter[word]
-        except KeyError:
-            print(f'{word} not in BatchCount')
+from util import BatchCount
+import text_processing
+from term_matrix import TermMatrix
+from typing import Set, Union
+
+
+class NeighbourhoodProfile:
+    """Word statistics of a local neighbourhood, gathered in one pass over its users: the word count and total of
+    every user, how many users used each word and the local count. WordFreq methods accept a profile wherever they
+    accept a list of users, and then use these statistics instead of recounting every user.
+    """
+
+    def __init__(self, user_counts: 'OrderedDict[str, Counter]') -> None:
+        """Creates a new NeighbourhoodProfile from the word count of every user."""
+        self.user_counts = user_counts
+        self.totals = OrderedDict()
+        self.word_dist = Counter()
+        self.local_count = BatchCount(Counter())
+        for user, user_count in user_counts.items():
+            self.totals[user] = sum(user_count.values())
+            self.word_dist.update(user_count.keys())
+            self.local_count.update(BatchCount(user_count, self.totals[user]))
+        self._term_matrix = None
+
+    def __iter__(self):
+        return iter(self.user_counts)
+
+    def __len__(self):
+        return len(self.user_counts)
+
+    def term_matrix(self) -> TermMatrix:
+        """Return the user x term matrix of the word counts of the neighbourhood."""
+        if self._term_matrix is None:
+            self._term_matrix = TermMatrix.from_counts(self.user_counts)
+        return self._term_matrix
 
 
 # extract useful class/interface out of ranking since it is reused here
 class WordFreq:
 
-    def __init__(self, start, end):
+    def __init__(self, start, end, global_window: Tuple[datetime, datetime] = (None, None)):
+        """'global_window' is the timeframe of the global count, by default the count logged before counts were
+        bucketed.
+        """
         self.r = Ranking(start, end)
+        self.global_window = global_window
+        self._user_counts = {}
 
     def friends(self, user: str) -> List[str]:
         """Return the list of friends of a user."""
@@ -47,42 +60,33 @@ class WordFreq:
         """Return the word count of given text."""
         if not text:
             return Counter()
-        text = text.lower()
-        sno = nltk.stem.SnowballStemmer('english')
-        s = text.split()
-        d = pd.DataFrame(s)
-        s1 = d[0].apply(lambda x: sno.stem(x))
-        counts = Counter(s1)
-        return counts
+        return text_processing.word_count(text)
 
     def user_word_total(self, user):
         return sum(self.user_count(user).values())
 
     def user_count(self, user: str) -> Counter:
-        """Return the word count of a user."""
-        user_text = self.r.timeline_to_document(user)
-        return self.word_count(user_text)
+        """Return the word count of a user. Every user is only counted once per WordFreq."""
+        if user not in self._user_counts:
+            user_text = self.r.timeline_to_document(user)
+            self._user_counts[user] = self.word_count(user_text)
+        return self._user_counts[user]
+
+    def profile(self, local: Union[List[str], NeighbourhoodProfile]) -> NeighbourhoodProfile:
+        """Return the NeighbourhoodProfile of the local neighbourhood."""
+        if isinstance(local, NeighbourhoodProfile):
+            return local
+        return NeighbourhoodProfile(OrderedDict((user, self.user_count(user)) for user in local))
 
     def local_count(self, local) -> BatchCount:
         """Return the local word count."""
-        local_count = BatchCount(Counter())
-        for user in local:
-            user_count = BatchCount(self.user_count(user))
-            local_count.update(user_count)
-        return local_count
+        local_count = self.profile(local).local_count
+        return BatchCount(Counter(local_count.counter), local_count.total)
 
 # change this percentage 0.05
     def word_dist(self, local) -> Counter:
         """Return a counter of how many users in the local neighbourhood(value) used the word(key)."""
-        word_dist = Counter()
-        for user in local:
-            user_count = self.user_count(user)
-            for word in user_count.keys():
-                if word_dist[word]:
-                    word_dist[word] += 1
-                else:
-                    word_dist[word] = 1
-        return word_dist
+        return Counter(self.profile(local).word_dist)
 
 # I need to run stemming
     def processed_local_count(self, local) -> BatchCount:
@@ -103,8 +107,8 @@ class WordFreq:
         return local_count
 
     def global_count(self) -> BatchCount:
-        """Return the real global count from the database."""
-        return BatchCount(self.r.db.get_global_freq())
+        """Return the real global count from the database. It is cached, so repeated calls are cheap."""
+        return self.r.db.get_global_count(*self.global_window)
 
     def processed_global_count(self) -> BatchCount:
         """Return the processed global count."""
@@ -123,6 +127,7 @@ class WordFreq:
 
     def processed_local_plus_global_count(self, local) -> BatchCount:
         """Return the processed local + global word count."""
+        local = self.profile(local)
         unprocessed_count = self.local_plus_global_count(local)
         processed_count = copy.deepcopy(unprocessed_count)
         # Total count can't be less than n
@@ -149,6 +154,7 @@ class WordFreq:
         return rel_freq
 
     def words_high_freq(self, local: List[str], _global: BatchCount, n=20) -> Counter:
+        local = self.profile(local)
         counter = Counter()
         for user in local:
             rel_freq = self.relative_frequency(user, _global)
@@ -159,10 +165,41 @@ class WordFreq:
                     counter[k] += 1
         return counter
 
+    def term_matrix(self, local: List[str]) -> TermMatrix:
+        """Return the user x term matrix of the word counts of the local neighbourhood."""
+        return self.profile(local).term_matrix()
+
+    def relative_frequency_matrix(self, local: List[str], n: int = 4) -> TermMatrix:
+        """Vectorized relative_frequency of every user in the local neighbourhood against
+        processed_local_plus_global_count: stopwords, words with a local + global count less than n and words used
+        by less than n users are dropped, and every column is divided by its local + global count.
+        """
+        terms = self.term_matrix(local)
+        totals = terms.totals() + terms.align(self.global_count().counter)
+        keep = ~terms.mask(stopwords()) & (totals >= n) & (terms.document_frequency() >= n)
+        return terms.select(keep).divide(totals[keep])
+
+    def high_freq_words(self, local: List[str], n: int = 20) -> Counter:
+        """Vectorized words_high_freq: how many users of the local neighbourhood have each word among their n words
+        of highest relative frequency.
+        """
+        counter = Counter()
+        for words in self.relative_frequency_matrix(local).top_terms(n).values():
+            counter.update(words)
+        return counter
+
+
+def stopwords() -> Set[str]:
+    """Return the stopwords removed from processed counts."""
+    words = set(nltk.corpus.stopwords.words('english'))
+    words.add('amp')
+    return words
+
+
 if __name__ == "__main__":
     w = WordFreq(datetime(2019, 3, 1), datetime(2019, 5, 1))
     local = w.friends('jonLorraine9')
-    local = [user for user in local if w.user_word_total(user) > 20]
+    local = w.profile([user for user in local if w.user_word_total(user) > 20])
     # print(w.processed_local_count(local))
     # print(w.global_count())
     # print(w.processed_global_count())